@@ -7,15 +7,15 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 # ---------------------------------------------------------
 # IMPORTS
 # ---------------------------------------------------------
+# Speech, TTS and OCR libraries are imported by the features that use them.
+import asyncio
 import logging
 from pathlib import Path
-import speech_recognition as sr
-import pyttsx3
-from PIL import Image
-import pypdf, docx, pptx
-import pytesseract
 
-from core import adaptive, add_topic, call_model
+import core
+from core import adaptive, add_topic
+import extraction
+from summarizer import summarize_long_text
 
 # ---------------------------------------------------------
 # LOGGING
@@ -32,6 +32,8 @@ logging.basicConfig(
 # ---------------------------------------------------------
 def speak(text):
     try:
+        import pyttsx3
+
         engine = pyttsx3.init()
         engine.say(text)
         engine.runAndWait()
@@ -41,10 +43,15 @@ def speak(text):
 # ---------------------------------------------------------
 # VOICE INPUT
 # ---------------------------------------------------------
-rec = sr.Recognizer()
+rec = None
 
 def get_voice():
+    global rec
     try:
+        import speech_recognition as sr
+
+        if rec is None:
+            rec = sr.Recognizer()
         with sr.Microphone() as src:
             audio = rec.listen(src, timeout=3, phrase_time_limit=4)
             return rec.recognize_google(audio)
@@ -55,30 +62,8 @@ def get_voice():
 # FILE PARSING
 # ---------------------------------------------------------
 def extract_text(path):
-    p = Path(path)
-    ext = p.suffix.lower()
-
-    if ext == ".pdf":
-        r = pypdf.PdfReader(path)
-        return "\n".join(pg.extract_text() or "" for pg in r.pages)
-
-    if ext == ".docx":
-        d = docx.Document(path)
-        return "\n".join(par.text for par in d.paragraphs)
-
-    if ext == ".pptx":
-        pres = pptx.Presentation(path)
-        return "\n".join(
-            shape.text
-            for slide in pres.slides
-            for shape in slide.shapes
-            if hasattr(shape, "text")
-        )
-
-    if ext in [".jpg", ".jpeg", ".png"]:
-        return pytesseract.image_to_string(Image.open(path))
-
-    return p.read_text(errors="ignore")
+    # Images and scanned PDF pages are OCRed in the extraction pool.
+    return extraction.extract_text(Path(path))
 
 # HANDLE TURN  (QUIZ REMOVED)
 # ---------------------------------------------------------
@@ -109,6 +94,10 @@ def handle(profile, state, voice=False):
 # ---------------------------------------------------------
 # UPLOAD
 # ---------------------------------------------------------
+# One loop for the whole session: the async model clients are bound to the
+# loop they were first used on.
+loop = asyncio.new_event_loop()
+
 def upload(profile, state):
     path = input("File path: ").strip()
     p = Path(path)
@@ -118,7 +107,7 @@ def upload(profile, state):
         return
 
     text = extract_text(path)
-    summary = call_model("Summarize:\n" + text[:4000])
+    summary = loop.run_until_complete(summarize_long_text(text))
     print("\nSummary:\n" + summary + "\n")
 
 # ---------------------------------------------------------
@@ -126,6 +115,8 @@ def upload(profile, state):
 # ---------------------------------------------------------
 def main():
     print("\nNeuroAdaptive Learning Companion — TURBO STABLE MODE\n")
+    # Load the model client while the user picks a profile.
+    core.startup(background=True)
 
     profile = ""
     while profile not in ("normal", "adhd"):
@@ -140,6 +131,7 @@ def main():
 
         if cmd == "exit":
             print("Saving memory... Goodbye.")
+            core.shutdown()
             return
 
         if cmd == "t":
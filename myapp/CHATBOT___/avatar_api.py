@@ -1,58 +1,121 @@
-from flask import Flask, request, jsonify
+import os
+import time
+
+from flask import Flask, Response, g, request, jsonify
 from pathlib import Path
-import json
 from flask_cors import CORS
 
+from catalog import Catalog
+from leaderboard import Leaderboard
+import metrics
+from user_store import Rejected, UserStore
+
 app = Flask(__name__)
 CORS(app)
 
 DATA_PATH = Path(__file__).parent / "avatar_users.json"
+DB_PATH = Path(os.getenv("AVATAR_DB_PATH", Path(__file__).parent / "avatar_users.db"))
 
-ITEM_MANIFEST = [
-    {"id": "hoodie_blue", "name": "Blue Hoodie", "slot": "top", "xpCost": 500, "modelPath": "hoodie_blue.glb"},
-    {"id": "crew_cut", "name": "Crew Cut", "slot": "hair", "xpCost": 200, "modelPath": "crew_cut.glb"},
-    {"id": "shoes_white", "name": "White Sneakers", "slot": "footwear", "xpCost": 350, "modelPath": "shoes_white.glb"},
-]
+ITEMS_PATH = Path(__file__).parent / "items.json"
+MAX_ITEMS_PAGE = 500
 
+catalog = Catalog(ITEMS_PATH)
+
+
+def new_user(user_id: str) -> dict:
+    return {
+        "name": user_id,
+        "level": 1,
+        "xp": 0,
+        "xpToNextLevel": 1000,
+        "totalXP": 0,
+        "badges": 0,
+        "coins": 0,
+        "avatar": {
+            "top": "hoodie_blue",
+            "hair": "crew_cut",
+            "footwear": "shoes_white",
+        },
+        "inventory": ["hoodie_blue", "crew_cut", "shoes_white"],
+    }
+
+
+users = UserStore(DB_PATH, new_user)
+users.migrate_json(DATA_PATH)
+leaderboard = Leaderboard(users.totals())
+MAX_LEADERBOARD_PAGE = 100
+MAX_XP_BATCH = 1000
+LEVEL_XP_STEP = 1000
+
+
+def xp_for_level(level: int) -> int:
+    """Total XP needed to reach ``level`` (1000 for level 2, then 2000 more, ...)."""
+    return LEVEL_XP_STEP * (level - 1) * level // 2
+
+
+def apply_xp(user: dict, amount: int) -> None:
+    user["xp"] = int(user.get("xp", 0)) + amount
+    user["totalXP"] = int(user.get("totalXP", 0)) + amount
+    level = max(int(user.get("level", 1)), 1)
+    while user["totalXP"] >= xp_for_level(level + 1):
+        level += 1
+    user["level"] = level
+    user["xpToNextLevel"] = xp_for_level(level + 1) - user["totalXP"]
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response: Response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=request.url_rule.rule if request.url_rule else "unmatched",
+            status=response.status_code,
+        )
+    return response
 
-def load_users():
-    if DATA_PATH.exists():
-        try:
-            return json.loads(DATA_PATH.read_text())
-        except Exception:
-            return {}
-    return {}
-
-
-def save_users(users):
-    DATA_PATH.write_text(json.dumps(users, indent=2))
-
-
-def get_or_create_user(users, user_id: str):
-    user = users.get(user_id)
-    if not user:
-        user = {
-            "name": user_id,
-            "level": 1,
-            "xp": 0,
-            "xpToNextLevel": 1000,
-            "totalXP": 0,
-            "badges": 0,
-            "coins": 0,
-            "avatar": {
-                "top": "hoodie_blue",
-                "hair": "crew_cut",
-                "footwear": "shoes_white",
-            },
-            "inventory": ["hoodie_blue", "crew_cut", "shoes_white"],
-        }
-        users[user_id] = user
-    return user
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.errorhandler(Rejected)
+def rejected(exc: Rejected):
+    return jsonify({"error": exc.message}), exc.status
 
 
 @app.get("/api/items")
 def get_items():
-    return jsonify(ITEM_MANIFEST)
+    """Items as a JSON array, optionally filtered by ``slot`` and paged with ``offset``/``limit``.
+
+    The total size of the selection is returned in ``X-Total-Count``.
+    """
+    slot = request.args.get("slot") or None
+    try:
+        offset = max(int(request.args.get("offset", 0)), 0)
+        limit = request.args.get("limit")
+        limit = min(max(int(limit), 0), MAX_ITEMS_PAGE) if limit is not None else None
+    except ValueError:
+        return jsonify({"error": "Invalid input"}), 400
+
+    snapshot = catalog.snapshot()
+    etag = f"{snapshot.version}-{slot or '*'}-{offset}-{limit if limit is not None else '*'}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body, total = snapshot.render(slot, offset, limit)
+        response = Response(body, mimetype="application/json")
+        response.headers["X-Total-Count"] = str(total)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @app.post("/api/user/addXP")
@@ -63,12 +126,70 @@ def add_xp():
     if not user_id or amount <= 0:
         return jsonify({"error": "Invalid input"}), 400
 
-    users = load_users()
-    user = get_or_create_user(users, user_id)
-    user["xp"] = int(user.get("xp", 0)) + amount
-    user["totalXP"] = int(user.get("totalXP", 0)) + amount
-    save_users(users)
-    return jsonify(user)
+    key = data.get("idempotencyKey")
+    updated, _ = users.apply_xp_events([(key, user_id, amount)], apply_xp)
+    if user_id not in updated:
+        # A retry of an event that was already applied.
+        user = users.get(user_id)
+        if user is None:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify(user)
+    leaderboard.update(user_id, updated[user_id]["totalXP"])
+    return jsonify(updated[user_id])
+
+
+@app.post("/api/user/addXP/batch")
+def add_xp_batch():
+    """Applies many XP events at once: ``{"events": [{userId, amount, idempotencyKey}]}``.
+
+    Events are coalesced into one write per user; events whose
+    ``idempotencyKey`` has been seen before are skipped, so retries are safe.
+    """
+    data = request.get_json(force=True) or {}
+    raw_events = data.get("events")
+    if not isinstance(raw_events, list) or not raw_events or len(raw_events) > MAX_XP_BATCH:
+        return jsonify({"error": "Invalid input"}), 400
+
+    events = []
+    for event in raw_events:
+        try:
+            user_id = event.get("userId")
+            amount = int(event.get("amount", 0))
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({"error": "Invalid input"}), 400
+        if not user_id or amount <= 0:
+            return jsonify({"error": "Invalid input"}), 400
+        events.append((event.get("idempotencyKey"), user_id, amount))
+
+    updated, duplicates = users.apply_xp_events(events, apply_xp)
+    for user_id, user in updated.items():
+        leaderboard.update(user_id, user["totalXP"])
+    return jsonify({
+        "applied": len(events) - duplicates,
+        "duplicates": duplicates,
+        "users": updated,
+    })
+
+
+@app.get("/api/leaderboard")
+def get_leaderboard():
+    try:
+        k = min(max(int(request.args.get("k", 10)), 1), MAX_LEADERBOARD_PAGE)
+    except ValueError:
+        return jsonify({"error": "Invalid input"}), 400
+    return jsonify({"entries": leaderboard.top(k), "total": len(leaderboard)})
+
+
+@app.get("/api/leaderboard/<user_id>")
+def get_user_standing(user_id):
+    try:
+        radius = min(max(int(request.args.get("radius", 3)), 0), MAX_LEADERBOARD_PAGE // 2)
+    except ValueError:
+        return jsonify({"error": "Invalid input"}), 400
+    standing = leaderboard.standing(user_id, radius)
+    if standing is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify(standing)
 
 
 @app.post("/api/avatar/buy")
@@ -79,23 +200,22 @@ def buy_item():
     if not user_id or not item_id:
         return jsonify({"error": "Invalid input"}), 400
 
-    item = next((i for i in ITEM_MANIFEST if i["id"] == item_id), None)
+    item = catalog.get(item_id)
     if not item:
         return jsonify({"error": "Item not found"}), 404
 
-    users = load_users()
-    user = get_or_create_user(users, user_id)
-    xp = int(user.get("xp", 0))
-    cost = int(item.get("xpCost", 0))
-    if xp < cost:
-        return jsonify({"error": "Not enough XP"}), 400
+    def change(user):
+        xp = int(user.get("xp", 0))
+        cost = int(item.get("xpCost", 0))
+        if xp < cost:
+            raise Rejected("Not enough XP")
+
+        user["xp"] = xp - cost
+        inv = set(user.get("inventory", []))
+        inv.add(item_id)
+        user["inventory"] = sorted(inv)
 
-    user["xp"] = xp - cost
-    inv = set(user.get("inventory", []))
-    inv.add(item_id)
-    user["inventory"] = sorted(inv)
-    save_users(users)
-    return jsonify(user)
+    return jsonify(users.update(user_id, change))
 
 
 @app.post("/api/avatar/equip")
@@ -107,21 +227,19 @@ def equip_item():
     if not user_id or not item_id or not slot:
         return jsonify({"error": "Invalid input"}), 400
 
-    item = next((i for i in ITEM_MANIFEST if i["id"] == item_id), None)
+    item = catalog.get(item_id)
     if not item or item.get("slot") != slot:
         return jsonify({"error": "Item/slot mismatch"}), 400
 
-    users = load_users()
-    user = get_or_create_user(users, user_id)
+    def change(user):
+        if item_id not in user.get("inventory", []):
+            raise Rejected("Item not in inventory")
 
-    if item_id not in user.get("inventory", []):
-        return jsonify({"error": "Item not in inventory"}), 400
+        avatar = user.get("avatar") or {}
+        avatar[slot] = item_id
+        user["avatar"] = avatar
 
-    avatar = user.get("avatar") or {}
-    avatar[slot] = item_id
-    user["avatar"] = avatar
-    save_users(users)
-    return jsonify(user)
+    return jsonify(users.update(user_id, change))
 
 
 if __name__ == "__main__":
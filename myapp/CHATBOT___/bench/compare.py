@@ -0,0 +1,58 @@
+"""Compares two ``bench/run.py`` result files, scenario by scenario.
+
+    python bench/compare.py bench/results/<old>.json bench/results/<new>.json
+
+Prints throughput and latency percentiles side by side with the relative
+change; the exit status is 1 when any p95 regressed by more than
+``--threshold`` percent.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def _change(old, new) -> str:
+    if old in (None, 0) or new is None:
+        return "   n/a"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    old = json.loads(args.old.read_text())
+    new = json.loads(args.new.read_text())
+    if old.get("options") != new.get("options"):
+        print("warning: runs used different options; numbers may not be comparable")
+    print(f"{old['commit']} -> {new['commit']}")
+
+    regressed = False
+    for scenario, levels in new["results"].items():
+        previous = {lvl["concurrency"]: lvl for lvl in old["results"].get(scenario, [])}
+        for level in levels:
+            before = previous.get(level["concurrency"])
+            if before is None:
+                continue
+            cells = []
+            for metric in METRICS:
+                cells.append(
+                    f"{metric}={before[metric]}->{level[metric]} "
+                    f"({_change(before[metric], level[metric])})"
+                )
+            print(f"{scenario:20} c={level['concurrency']:<4} " + "  ".join(cells))
+            p95_old, p95_new = before["p95_ms"], level["p95_ms"]
+            if p95_old and p95_new and (p95_new - p95_old) / p95_old * 100 > args.threshold:
+                regressed = True
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Generated documents and images for the benchmark suite.
+
+Every fixture takes a ``variant`` number that is written into its content,
+so a run can send distinct documents and measure the uncached path instead
+of the summary cache.
+"""
+
+import io
+
+_SENTENCES = [
+    "Photosynthesis turns light, water and carbon dioxide into sugar and oxygen.",
+    "Cells are the smallest units of life and contain the genetic material.",
+    "Fractions describe parts of a whole and can be added once denominators match.",
+    "The water cycle moves water between oceans, clouds, rain and rivers.",
+    "Newton's laws relate the forces on an object to how its motion changes.",
+    "A paragraph groups sentences around one main idea and its supporting details.",
+]
+
+
+def _lines(variant: int, count: int) -> list[str]:
+    return [
+        f"[{variant}.{i}] {_SENTENCES[(variant + i) % len(_SENTENCES)]}" for i in range(count)
+    ]
+
+
+def make_pdf(variant: int = 0, pages: int = 10, lines_per_page: int = 30) -> bytes:
+    """A text PDF written by hand, so no PDF writer library is needed."""
+    objects: list[bytes] = []
+    page_ids = []
+    font_id = 3
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for p in range(pages):
+        text = ["BT /F1 10 Tf 50 780 Td 12 TL"]
+        for line in _lines(variant * 1000 + p, lines_per_page):
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            text.append(f"({escaped}) Tj T*")
+        text.append("ET")
+        stream = "\n".join(text).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects) + 2
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (font_id, content_id)
+        )
+        page_ids.append(len(objects) + 2)
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    catalog = b"<< /Type /Catalog /Pages 2 0 R >>"
+    page_tree = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+    objects = [catalog, page_tree] + objects
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(
+        b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+        % (len(objects) + 1, xref)
+    )
+    return out.getvalue()
+
+
+def make_docx(variant: int = 0, paragraphs: int = 200) -> bytes:
+    from docx import Document
+
+    document = Document()
+    document.add_heading(f"Study notes {variant}", level=1)
+    for line in _lines(variant, paragraphs):
+        document.add_paragraph(line)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def make_pptx(variant: int = 0, slides: int = 20) -> bytes:
+    from pptx import Presentation
+
+    deck = Presentation()
+    layout = deck.slide_layouts[1]  # title and content
+    for s in range(slides):
+        slide = deck.slides.add_slide(layout)
+        slide.shapes.title.text = f"Lesson {variant}.{s}"
+        slide.placeholders[1].text = "\n".join(_lines(variant * 1000 + s, 5))
+    out = io.BytesIO()
+    deck.save(out)
+    return out.getvalue()
+
+
+def make_png(variant: int = 0, size: tuple[int, int] = (1280, 720)) -> bytes:
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", size, (245, 245, 240))
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(_lines(variant, 20)):
+        draw.text((40, 30 + i * 32), line, fill=(20, 20, 20))
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+DOCUMENTS = {
+    "pdf": (make_pdf, "application/pdf"),
+    "docx": (
+        make_docx,
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ),
+    "pptx": (
+        make_pptx,
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ),
+}
@@ -0,0 +1,114 @@
+"""Import-time budget check for the app's entry modules.
+
+Imports each module in a fresh interpreter (with ``LLM_BACKEND=fake`` so no
+API key is needed) and fails when it takes longer than its budget or when it
+pulls in one of the heavy libraries that must only load on first use::
+
+    python bench/import_budget.py            # exit status 1 on a regression
+    python bench/import_budget.py --json     # machine-readable report
+
+The same check runs under pytest as ``test_import_budget.py``.
+
+Timings come from ``-X importtime`` and are the median of ``--runs`` runs.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+# Cumulative import time budgets in milliseconds.
+BUDGETS_MS = {
+    "core": 150,
+    "llm_gateway": 200,
+    "chat_api": 700,
+    "avatar_api": 500,
+    "Chatbot": 200,
+}
+
+# Loaded lazily by the features that need them; importing any entry module
+# must not load these.
+HEAVY_MODULES = (
+    "google.generativeai",
+    "PIL",
+    "bs4",
+    "pypdf",
+    "docx",
+    "pptx",
+    "speech_recognition",
+    "pyttsx3",
+    "pytesseract",
+)
+
+_IMPORTTIME = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)")
+
+
+def measure(module: str, cwd: str) -> tuple[float, list[str]]:
+    """Import time of ``module`` in ms and the heavy modules it loaded."""
+    code = (
+        f"import sys, json; import {module}; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    env = dict(
+        os.environ,
+        LLM_BACKEND="fake",
+        PYTHONPATH=str(APP_DIR),
+        AVATAR_DB_PATH=str(Path(cwd) / "avatar_users.db"),
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True,
+    )
+    total_us = next(
+        int(us) for us, name in _IMPORTTIME.findall(result.stderr) if name == module
+    )
+    return total_us / 1000, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check(module: str, cwd: str, runs: int = 5) -> dict:
+    """Median import time of ``module`` against its budget, plus heavy modules it loaded."""
+    samples = [measure(module, cwd) for _ in range(runs)]
+    median = statistics.median(ms for ms, _ in samples)
+    heavy = sorted({name for _, loaded in samples for name in loaded})
+    budget = BUDGETS_MS[module]
+    return {
+        "median_ms": round(median, 1),
+        "budget_ms": budget,
+        "heavy_modules": heavy,
+        "ok": median <= budget and not heavy,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    report = {}
+    failed = False
+    # A scratch working directory: some modules create log files on import.
+    with tempfile.TemporaryDirectory(prefix="import-budget-") as cwd:
+        for module in BUDGETS_MS:
+            report[module] = check(module, cwd, args.runs)
+            failed |= not report[module]["ok"]
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for module, row in report.items():
+            status = "ok  " if row["ok"] else "FAIL"
+            extra = f"  loads {', '.join(row['heavy_modules'])}" if row["heavy_modules"] else ""
+            print(f"{status} {module:12} {row['median_ms']:7.1f} ms / {row['budget_ms']} ms{extra}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+"""Load benchmark for chat_api and avatar_api against the fake model backend.
+
+Starts both services as subprocesses with ``LLM_BACKEND=fake`` and scratch
+data directories, drives each scenario at the requested concurrency levels
+and writes p50/p95/p99 latency and throughput to a JSON file named after the
+current commit, e.g.::
+
+    python bench/run.py --concurrency 1,8,32 --requests 200
+    python bench/compare.py bench/results/<old>.json bench/results/<new>.json
+
+The fake backend is tuned with the ``FAKE_LLM_*`` options below (see
+``fake_llm``).  Results only compare like for like: same options, same machine.
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import requests
+
+import fixtures
+
+APP_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+Request = Callable[[requests.Session, int], requests.Response]
+
+
+# ---------------------------------------------------------
+# SERVICES
+# ---------------------------------------------------------
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{proc.args} exited with {proc.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_services(args, scratch: Path) -> tuple[dict[str, str], list[subprocess.Popen]]:
+    env = dict(
+        os.environ,
+        LLM_BACKEND="fake",
+        FAKE_LLM_LATENCY=str(args.fake_latency),
+        FAKE_LLM_ERROR_RATE=str(args.fake_error_rate),
+        FAKE_LLM_429_RATE=str(args.fake_429_rate),
+        # Benchmark traffic comes from a handful of user ids; don't rate-limit it.
+        LLM_USER_RATE="100000",
+        LLM_USER_BURST="100000",
+        LLM_QUEUE_INTERACTIVE="100000",
+        LLM_QUEUE_SNAPSHOT="100000",
+        LLM_QUEUE_BULK="100000",
+        TOPIC_DB_PATH=str(scratch / "topics.db"),
+        SUMMARY_CACHE_DIR=str(scratch / "summary_cache"),
+        HTTP_CACHE_DIR=str(scratch / "http_cache"),
+        OCR_CACHE_DIR=str(scratch / "ocr_cache"),
+        RETRIEVAL_DIR=str(scratch / "doc_index"),
+        UPLOAD_DIR=str(scratch / "uploads"),
+        AVATAR_DB_PATH=str(scratch / "avatar_users.db"),
+    )
+    chat_port, avatar_port = _free_port(), _free_port()
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "chat_api:app", "--port", str(chat_port),
+             "--log-level", "warning", "--workers", str(args.workers)],
+            cwd=APP_DIR, env=env,
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "flask", "--app", "avatar_api", "run",
+             "--port", str(avatar_port), "--with-threads"],
+            cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ),
+    ]
+    urls = {
+        "chat": f"http://127.0.0.1:{chat_port}",
+        "avatar": f"http://127.0.0.1:{avatar_port}",
+    }
+    try:
+        _wait_ready(urls["chat"] + "/metrics", procs[0])
+        _wait_ready(urls["avatar"] + "/metrics", procs[1])
+    except Exception:
+        stop_services(procs)
+        raise
+    return urls, procs
+
+
+def stop_services(procs: list[subprocess.Popen]) -> None:
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# ---------------------------------------------------------
+# SCENARIOS
+# ---------------------------------------------------------
+def scenarios(urls: dict[str, str], variants: int) -> dict[str, Request]:
+    chat, avatar = urls["chat"], urls["avatar"]
+    run_id = uuid.uuid4().hex[:8]
+    docs = {
+        kind: [(make(v), mime) for v in range(variants)]
+        for kind, (make, mime) in fixtures.DOCUMENTS.items()
+    }
+    pngs = [
+        "data:image/png;base64," + base64.b64encode(fixtures.make_png(v)).decode()
+        for v in range(min(variants, 20))
+    ]
+
+    def chat_request(session, i):
+        # A distinct question per request, so the response cache is not measured.
+        return session.post(
+            f"{chat}/api/chat",
+            json={"message": f"Explain topic {run_id}-{i} simply", "userId": f"bench{i % 50}"},
+        )
+
+    def chat_cached(session, i):
+        return session.post(
+            f"{chat}/api/chat", json={"message": f"Explain topic {i % 5}", "userId": "bench"}
+        )
+
+    def upload(kind):
+        def send(session, i):
+            body, mime = docs[kind][i % variants]
+            return session.post(
+                f"{chat}/api/upload-file",
+                files={"file": (f"notes{i}.{kind}", body, mime)},
+            )
+        return send
+
+    def snapshot(session, i):
+        return session.post(f"{chat}/api/process-snapshot", json={"image": pngs[i % len(pngs)]})
+
+    def items(session, i):
+        return session.get(f"{avatar}/api/items")
+
+    def add_xp(session, i):
+        return session.post(
+            f"{avatar}/api/user/addXP", json={"userId": f"bench{i % 500}", "amount": 10}
+        )
+
+    def leaderboard(session, i):
+        return session.get(f"{avatar}/api/leaderboard", params={"k": 10})
+
+    return {
+        "chat": chat_request,
+        "chat_cached": chat_cached,
+        "upload_pdf": upload("pdf"),
+        "upload_docx": upload("docx"),
+        "upload_pptx": upload("pptx"),
+        "snapshot": snapshot,
+        "avatar_items": items,
+        "avatar_add_xp": add_xp,
+        "avatar_leaderboard": leaderboard,
+    }
+
+
+# ---------------------------------------------------------
+# LOAD
+# ---------------------------------------------------------
+def percentile(sorted_values: list[float], q: float) -> float | None:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_level(send: Request, concurrency: int, total: int, first: int = 0) -> dict:
+    """Sends requests ``first`` .. ``first + total - 1`` from ``concurrency`` threads."""
+    local = threading.local()
+    counter = iter(range(first, first + total))
+    lock = threading.Lock()
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+
+    def worker():
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                status = str(send(session, i).status_code)
+            except requests.RequestException as exc:
+                status = type(exc).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == "200":
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(latencies),
+        "statuses": statuses,
+        "seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+    }
+
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def _commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True
+        )
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--scenarios", default="all", help="comma-separated names, or 'all'")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=100, help="requests per level")
+    parser.add_argument(
+        "--variants", type=int, help="distinct documents per type (default: one per request)"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--fake-latency", type=float, default=0.2)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    parser.add_argument("--fake-429-rate", type=float, default=0.0)
+    parser.add_argument("--out", type=Path, help="defaults to bench/results/<commit>.json")
+    args = parser.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    commit = _commit()
+    with tempfile.TemporaryDirectory(prefix="bench-") as scratch:
+        urls, procs = start_services(args, Path(scratch))
+        try:
+            variants = args.variants or args.requests * len(levels)
+            available = scenarios(urls, variants)
+            names = list(available) if args.scenarios == "all" else args.scenarios.split(",")
+            results = {}
+            for name in names:
+                results[name] = []
+                for n, concurrency in enumerate(levels):
+                    # Request numbers continue across levels so caches stay cold.
+                    level = run_level(
+                        available[name], concurrency, args.requests, n * args.requests
+                    )
+                    results[name].append(level)
+                    print(
+                        f"{name:20} c={concurrency:<4} {level['throughput_rps']:>8} rps  "
+                        f"p50={level['p50_ms']}ms p95={level['p95_ms']}ms "
+                        f"p99={level['p99_ms']}ms  {level['statuses']}",
+                        flush=True,
+                    )
+        finally:
+            stop_services(procs)
+
+    report = {
+        "commit": commit,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": {k: str(v) for k, v in vars(args).items() if k != "out"},
+        "results": results,
+    }
+    out = args.out or RESULTS_DIR / f"{commit}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
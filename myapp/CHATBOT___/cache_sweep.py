@@ -0,0 +1,121 @@
+"""Size and age limits for the on-disk caches.
+
+The summary, HTTP and OCR caches write one or two files per key and never
+delete them, so a long-running deployment fills its disk.  A ``CacheSweeper``
+owns one cache directory: the cache calls ``written`` after each write and,
+at most once per ``interval`` seconds, a background thread walks the
+directory, deletes files older than ``max_age`` and then, while the total is
+over ``max_bytes``, the least recently written files until it is back under
+90% of the limit.  File mtimes are the only bookkeeping, so several processes
+sharing a directory need no coordination (losing a race to delete a file is
+harmless).
+
+This module must stay free of imports from ``core``: the OCR cache uses it
+inside the extraction workers.
+"""
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from metrics import store_seconds
+
+logger = logging.getLogger("cache_sweep")
+
+CACHE_SWEEP_INTERVAL = float(os.getenv("CACHE_SWEEP_INTERVAL", "600"))
+# Fraction of ``max_bytes`` a size-triggered sweep shrinks the cache to.
+_LOW_WATER = 0.9
+# Temporary files younger than this may still be in the middle of a write.
+_TMP_GRACE = 3600.0
+
+
+class CacheSweeper:
+    """Keeps the files under ``root`` within ``max_bytes`` and ``max_age`` seconds."""
+
+    def __init__(
+        self,
+        name: str,
+        root: Path,
+        max_bytes: int,
+        max_age: float,
+        interval: float = CACHE_SWEEP_INTERVAL,
+    ):
+        self.name = name
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.removed = 0
+        self._next = 0.0  # the first write after start-up triggers a sweep
+        self._lock = threading.Lock()
+        self._running = False
+
+    def written(self) -> None:
+        """Called after each cache write; starts a background sweep when one is due."""
+        now = time.monotonic()
+        if now < self._next or self._running:
+            return
+        with self._lock:
+            if now < self._next or self._running:
+                return
+            self._running = True
+            self._next = now + self.interval
+        threading.Thread(target=self._run, name=f"{self.name}-sweep", daemon=True).start()
+
+    def _run(self) -> None:
+        try:
+            self.sweep()
+        except Exception:
+            logger.exception("Sweeping the %s cache failed", self.name)
+        finally:
+            self._running = False
+
+    def sweep(self) -> int:
+        """Deletes expired files, then the oldest ones past the size limit; returns how many."""
+        with store_seconds.time(store=self.name, op="sweep"):
+            now = time.time()
+            files = []
+            for path in self.root.rglob("*"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                if path.is_file():
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+            removed = 0
+            kept = []
+            total = 0
+            for mtime, size, path in files:
+                limit = _TMP_GRACE if path.suffix == ".tmp" else self.max_age
+                if now - mtime > limit:
+                    removed += _unlink(path)
+                elif path.suffix != ".tmp":
+                    kept.append((mtime, size, path))
+                    total += size
+
+            if total > self.max_bytes:
+                target = self.max_bytes * _LOW_WATER
+                for mtime, size, path in sorted(kept, key=lambda f: f[0]):
+                    if total <= target:
+                        break
+                    removed += _unlink(path)
+                    total -= size
+
+        if removed:
+            self.removed += removed
+            logger.info("Removed %d files from the %s cache", removed, self.name)
+        return removed
+
+
+def _unlink(path: Path) -> int:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        return 0  # another process got there first
+    except OSError as exc:
+        logger.warning("Could not remove cache file %s: %s", path, exc)
+        return 0
+    return 1
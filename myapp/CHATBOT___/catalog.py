@@ -0,0 +1,93 @@
+"""Indexed, versioned item catalog for the avatar store.
+
+Items are loaded from a JSON manifest into id and slot indexes, so lookups
+no longer scan the whole list.  Each load is an immutable snapshot whose
+version is a digest of the manifest bytes; responses are pre-serialized per
+snapshot and carry that version as their ETag, which lets the Store UI poll
+with ``If-None-Match`` and get a 304 until the manifest actually changes.
+The manifest file is re-read when its mtime or size changes.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+logger = logging.getLogger("catalog")
+
+
+class Snapshot:
+    """One immutable version of the catalog."""
+
+    def __init__(self, items: list[dict], version: str):
+        self.items = items
+        self.version = version
+        self.by_id = {item["id"]: item for item in items}
+        self.by_slot: dict[str, list[dict]] = {}
+        for item in items:
+            self.by_slot.setdefault(item.get("slot"), []).append(item)
+        self.render = lru_cache(maxsize=256)(self._render)
+
+    def get(self, item_id: str) -> dict | None:
+        return self.by_id.get(item_id)
+
+    def select(self, slot: str | None = None) -> list[dict]:
+        return self.items if slot is None else self.by_slot.get(slot, [])
+
+    def _render(self, slot: str | None, offset: int, limit: int | None) -> tuple[bytes, int]:
+        """Serialized JSON array for one page of the selection, plus the selection size."""
+        selected = self.select(slot)
+        end = None if limit is None else offset + limit
+        return json.dumps(selected[offset:end], separators=(",", ":")).encode("utf-8"), len(selected)
+
+
+class Catalog:
+    def __init__(self, path: Path, check_interval: float = 1.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._stat: tuple[float, int] | None = None
+        self._checked = 0.0
+        self._snapshot = self._load()
+
+    def _load(self) -> Snapshot:
+        stat = self.path.stat()
+        raw = self.path.read_bytes()
+        items = json.loads(raw)
+        if not isinstance(items, list) or not all(
+            isinstance(item, dict) and "id" in item for item in items
+        ):
+            raise ValueError(f"{self.path} must be a JSON list of items with an 'id'")
+        self._stat = (stat.st_mtime, stat.st_size)
+        return Snapshot(items, hashlib.sha256(raw).hexdigest()[:16])
+
+    def snapshot(self) -> Snapshot:
+        """Current catalog, reloading the manifest first if it changed on disk."""
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            with self._lock:
+                if now - self._checked >= self.check_interval:
+                    self._checked = now
+                    self._reload_if_changed()
+        return self._snapshot
+
+    def _reload_if_changed(self) -> None:
+        try:
+            stat = self.path.stat()
+        except OSError as exc:
+            logger.warning("Keeping catalog %s: %s", self._snapshot.version, exc)
+            return
+        if (stat.st_mtime, stat.st_size) == self._stat:
+            return
+        try:
+            self._snapshot = self._load()
+            logger.info("Reloaded catalog version %s", self._snapshot.version)
+        except (OSError, ValueError) as exc:
+            # A half-written or invalid manifest must not take the store down.
+            logger.warning("Keeping catalog %s: %s", self._snapshot.version, exc)
+
+    def get(self, item_id: str) -> dict | None:
+        return self.snapshot().get(item_id)
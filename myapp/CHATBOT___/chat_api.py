@@ -1,18 +1,51 @@
+import asyncio
+import json
 import logging
-import time
+import os
 import base64
-from pathlib import Path
-
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+import uuid
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator
+
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.datastructures import UploadFile as FormFile
 from pydantic import BaseModel
 
-from core import (
-    adaptive, 
-    add_topic, 
-    summarize_text, 
-    extract_text_from_url, 
-    extract_text_from_file,
-    analyze_image
+import conversation
+import core
+import deadline
+import images
+import metrics
+from core import add_topic, extract_text_from_url
+from doc_index import doc_index
+from deadline import (
+    BULK_REQUEST_TIMEOUT,
+    DEFAULT_REQUEST_TIMEOUT,
+    DeadlineExceeded,
+    DeadlineMiddleware,
+)
+from extraction import ExtractionError, aiter_pages
+from llm_gateway import (
+    adaptive_async,
+    analyze_image_async,
+    stream_adaptive,
+)
+from response_cache import adaptive_cache
+from router import router
+import scheduler
+from scheduler import Overloaded, Priority
+from sessions import Session, SessionOwnerMismatch, session_store
+from summarizer import summarize_long_text, summarize_pages
+from summary_cache import URL_SUMMARY_TTL, file_key, summary_cache, text_key, url_key
+from uploads import (
+    MAX_BATCH_BYTES,
+    MAX_SNAPSHOT_BYTES,
+    MAX_UPLOAD_BYTES,
+    BodySizeLimitMiddleware,
+    read_body,
+    spool_upload,
 )
 
 
@@ -21,11 +54,17 @@ class ChatRequest(BaseModel):
     profile: str = "normal"
     state: str = "calm"
     userId: str | None = None
-    history: list[dict] | None = None  # [{role: 'user'|'assistant', content: str}]
+    # Opts into server-side history kept under this id, e.g. a client-made
+    # uuid, or "user-<userId>" to share one conversation across devices.
+    sessionId: str | None = None
+    # Without a sessionId: the conversation so far, sent by the client.
+    # [{role: 'user'|'assistant', content: str}]
+    history: list[dict] | None = None
 
 
 class ChatResponse(BaseModel):
     reply: str
+    sessionId: str | None = None
 
 class SummaryResponse(BaseModel):
     summary: str
@@ -34,37 +73,148 @@ class UrlRequest(BaseModel):
     url: str
 
 class SnapshotRequest(BaseModel):
-    image: str # base64 encoded string
+    image: str  # base64 data URL
+
 
+# "sync" warms model clients and extraction workers before serving, "background"
+# serves immediately while they load, "off" leaves everything to first use.
+WARMUP = os.getenv("WARMUP", "sync")
 
-app = FastAPI(title="NeuroAdaptive Chatbot API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP == "sync":
+        await run_in_threadpool(core.startup, True)
+    elif WARMUP == "background":
+        core.startup(warm_extraction=True, background=True)
+    yield
+    await run_in_threadpool(core.shutdown)
+    await run_in_threadpool(session_store.flush)
+
+
+app = FastAPI(title="NeuroAdaptive Chatbot API", lifespan=lifespan)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        "/api/upload-file": MAX_UPLOAD_BYTES,
+        "/api/process-snapshot": MAX_SNAPSHOT_BYTES,
+        "/api/process-batch": MAX_BATCH_BYTES,
+    },
+)
+app.add_middleware(
+    DeadlineMiddleware,
+    default=DEFAULT_REQUEST_TIMEOUT,
+    limits={
+        "/api/upload-file": BULK_REQUEST_TIMEOUT,
+        "/api/process-url": BULK_REQUEST_TIMEOUT,
+        "/api/process-batch": BULK_REQUEST_TIMEOUT,
+    },
+)
+app.add_middleware(metrics.ASGIMetricsMiddleware)
 logger = logging.getLogger("chat_api")
 MAX_CHAT_RETRIES = 3
 BASE_BACKOFF = 0.8
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "50"))
+# Per-stage concurrency of one /api/process-batch request.
+BATCH_FETCH_CONCURRENCY = int(os.getenv("BATCH_FETCH_CONCURRENCY", "8"))
+BATCH_EXTRACT_CONCURRENCY = int(os.getenv("BATCH_EXTRACT_CONCURRENCY", "2"))
+BATCH_SUMMARIZE_CONCURRENCY = int(os.getenv("BATCH_SUMMARIZE_CONCURRENCY", "4"))
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server busy: {exc}"},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+
+def _collect_metrics():
+    cache = adaptive_cache.stats()
+    yield "response_cache_hits_total", "counter", {}, cache["hits"]
+    yield "response_cache_misses_total", "counter", {}, cache["misses"]
+    yield "response_cache_entries", "gauge", {}, cache["entries"]
+    yield "summary_cache_hits_total", "counter", {}, summary_cache.hits
+    yield "summary_cache_misses_total", "counter", {}, summary_cache.misses
+    yield "llm_active_calls", "gauge", {}, scheduler.scheduler.active
+    yield "llm_shed_total", "counter", {}, scheduler.scheduler.shed
+    for priority, depth in scheduler.scheduler.depths().items():
+        yield "llm_queue_depth", "gauge", {"priority": priority}, depth
+    for model, health in router.snapshot().items():
+        yield "llm_circuit_open", "gauge", {"model": model}, health["state"] != "closed"
+        yield "llm_error_rate", "gauge", {"model": model}, health["error_rate"]
+    yield "snapshot_cache_hits_total", "counter", {}, images.snapshot_cache.hits
+    yield "snapshot_cache_misses_total", "counter", {}, images.snapshot_cache.misses
+    yield "chat_sessions", "gauge", {}, len(session_store)
+    yield "chat_sessions_evicted_total", "counter", {}, session_store.evicted
+
+
+metrics.register_collector(_collect_metrics)
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+async def _open_session(payload: ChatRequest) -> Session | None:
+    """The server-side session, only when the client asked for one."""
+    if not payload.sessionId:
+        return None
+    try:
+        return await run_in_threadpool(session_store.get, payload.sessionId, payload.userId)
+    except SessionOwnerMismatch:
+        raise HTTPException(status_code=403, detail="session belongs to another user")
+
+
+def _history_text(payload: ChatRequest, session: Session | None) -> str | None:
+    if session is not None:
+        return conversation.history_text(
+            session.turns, f"session-{session.id}", offset=session.offset, seed=session.seed
+        )
+    return conversation.history_text(payload.history)
+
+
+def _remember(session: Session | None, prompt: str, reply: str) -> None:
+    if session is not None:
+        session_store.append(session, "user", prompt)
+        session_store.append(session, "assistant", reply)
 
 
-def _call_adaptive(payload: ChatRequest) -> str:
-    history_text = None
-    if payload.history:
-        # flatten last 10 entries into text blocks
-        pairs = []
-        for item in payload.history[-10:]:
-          role = item.get("role", "user")
-          content = item.get("content", "")
-          pairs.append(f"{role}: {content}")
-        history_text = "\n".join(pairs)
-    return adaptive(payload.profile, payload.state, payload.message.strip(), history_text)
+async def _document_context(payload: ChatRequest) -> str | None:
+    """The user's indexed document chunks most relevant to the message."""
+    if not payload.userId:
+        return None
+    return await run_in_threadpool(doc_index.context, payload.userId, payload.message.strip())
+
+
+async def _call_adaptive(payload: ChatRequest, history: str | None, context: str | None) -> str:
+    return await adaptive_async(
+        payload.profile, payload.state, payload.message.strip(), history, context
+    )
 
 
 @app.post("/api/chat", response_model=ChatResponse)
-def chat(payload: ChatRequest) -> ChatResponse:
+async def chat(payload: ChatRequest) -> ChatResponse:
     prompt = payload.message.strip()
     if not prompt:
         raise HTTPException(status_code=400, detail="message is required")
+    scheduler.use(Priority.INTERACTIVE, payload.userId)
+    session = await _open_session(payload)
+    history = _history_text(payload, session)
+    context = await _document_context(payload)
 
     for attempt in range(1, MAX_CHAT_RETRIES + 1):
         try:
-            reply = _call_adaptive(payload)
+            reply = await _call_adaptive(payload, history, context)
+        except (Overloaded, DeadlineExceeded):
+            raise
         except Exception as exc:  # pragma: no cover - external API
             logger.warning("LLM request attempt %s failed: %s", attempt, exc)
             if attempt == MAX_CHAT_RETRIES:
@@ -78,140 +228,353 @@ def chat(payload: ChatRequest) -> ChatResponse:
                         detail="LLM rate limit reached; please retry in a moment.",
                     )
             else:
-                add_topic(prompt[:40])
+                add_topic(prompt[:40], payload.userId)
+                _remember(session, prompt, reply)
                 logger.info(
                     f"Chat reply length: {len(reply)} chars. First 100 chars: {reply[:100]}"
                 )
-                return ChatResponse(reply=reply)
+                return ChatResponse(reply=reply, sessionId=session.id if session else None)
 
-        time.sleep(BASE_BACKOFF * (2 ** (attempt - 1)))
+        await deadline.sleep(BASE_BACKOFF * (2 ** (attempt - 1)))
 
     raise HTTPException(status_code=503, detail="Chatbot temporarily unavailable; please retry shortly.")
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(payload: ChatRequest):
+    """Streams the reply as Server-Sent Events.
+
+    ``delta`` events carry text to append, ``reset`` tells the client to drop
+    the partial reply because generation restarted on a fallback model, and
+    the stream ends with either ``done`` (full reply and session id) or
+    ``error``.
+    """
+    prompt = payload.message.strip()
+    if not prompt:
+        raise HTTPException(status_code=400, detail="message is required")
+    scheduler.use(Priority.INTERACTIVE, payload.userId)
+    session = await _open_session(payload)
+    history = _history_text(payload, session)
+    context = await _document_context(payload)
+
+    async def events():
+        parts: list[str] = []
+        stream = stream_adaptive(payload.profile, payload.state, prompt, history, context)
+        try:
+            async for event, text in stream:
+                if event == "delta":
+                    parts.append(text)
+                    yield _sse("delta", {"text": text})
+                elif event == "reset":
+                    parts.clear()
+                    yield _sse("reset", {})
+                else:
+                    logger.warning("Streaming chat failed: %s", text)
+                    yield _sse("error", {"detail": text})
+                    return
+        except Overloaded as exc:
+            yield _sse(
+                "error", {"detail": f"Server busy: {exc}", "retryAfter": round(exc.retry_after, 1)}
+            )
+            return
+        except DeadlineExceeded as exc:
+            yield _sse("error", {"detail": str(exc)})
+            return
+        reply = "".join(parts)
+        add_topic(prompt[:40], payload.userId)
+        _remember(session, prompt, reply)
+        yield _sse("done", {"reply": reply, "sessionId": session.id if session else None})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # --- Content Processing Endpoints ---
 
-class SummaryResponse(BaseModel):
-    summary: str
+async def _summarize_cached(text: str, context: str) -> str:
+    """Summarizes ``text`` once per distinct content, sharing in-flight work."""
 
-class UrlRequest(BaseModel):
-    url: str
+    async def compute() -> str:
+        summary = await summarize_long_text(text, context=context)
+        if summary.startswith("Model unavailable"):
+            raise HTTPException(status_code=502, detail=summary)
+        return summary
 
-class SnapshotRequest(BaseModel):
-    image: str  # base64 data URL
+    return await summary_cache.get_or_compute(text_key(text), compute)
 
 
-@app.post("/api/process-url", response_model=SummaryResponse)
-def process_url(payload: UrlRequest):
-    if not payload.url:
-        raise HTTPException(status_code=400, detail="URL is required")
-    text = extract_text_from_url(payload.url)
-    if text.startswith("Error:"):
-        raise HTTPException(status_code=500, detail=text)
-    summary = summarize_text(text, context=f"from the URL {payload.url}")
-    if summary.startswith("Model unavailable"):
-        raise HTTPException(status_code=502, detail=summary)
-    return SummaryResponse(summary=summary)
+async def _summarize_url(
+    url: str,
+    fetch_slots: asyncio.Semaphore | None = None,
+    summarize_slots: asyncio.Semaphore | None = None,
+) -> str:
+    async def compute() -> str:
+        async with fetch_slots or nullcontext():
+            text = await run_in_threadpool(extract_text_from_url, url)
+        deadline.check()
+        if text.startswith("Error:"):
+            raise HTTPException(status_code=500, detail=text)
+        async with summarize_slots or nullcontext():
+            return await _summarize_cached(text, context=f"from the URL {url}")
 
+    return await summary_cache.get_or_compute(url_key(url), compute, max_age=URL_SUMMARY_TTL)
 
-@app.post("/api/upload-file", response_model=SummaryResponse)
-async def upload_file(file: UploadFile = File(...)):
-    if not file:
-        raise HTTPException(status_code=400, detail="No file uploaded")
-    temp_dir = Path("temp_uploads")
-    temp_dir.mkdir(exist_ok=True)
-    file_path = temp_dir / file.filename
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
-    try:
-        text = extract_text_from_file(file_path)
-    finally:
-        try:
-            file_path.unlink(missing_ok=True)
-        except Exception:
-            pass
-    if text.startswith("Error:"):
-        raise HTTPException(status_code=500, detail=text)
-    summary = summarize_text(text, context=f"from the file {file.filename}")
-    if summary.startswith("Model unavailable"):
-        raise HTTPException(status_code=502, detail=summary)
-    return SummaryResponse(summary=summary)
 
+async def _collect(pages: AsyncIterator[str], into: list[str]) -> AsyncIterator[str]:
+    async for page in pages:
+        into.append(page)
+        yield page
 
-@app.post("/api/process-snapshot", response_model=SummaryResponse)
-def process_snapshot(payload: SnapshotRequest):
-    if not payload.image:
-        raise HTTPException(status_code=400, detail="No image data provided")
-    try:
-        header, encoded = payload.image.split(",", 1)
-        image_data = base64.b64decode(encoded)
-    except (ValueError, TypeError):
-        raise HTTPException(status_code=400, detail="Invalid base64 image format")
-    summary = analyze_image(image_data, prompt="Describe the content of this image.")
-    if summary.startswith("Error:"):
-        raise HTTPException(status_code=500, detail=summary)
-    return SummaryResponse(summary=summary)
+
+_indexing: set[asyncio.Task] = set()
 
 
-# --- NEW ENDPOINTS ---
+def _index_in_background(user_id: str, digest: str, filename: str, pages: list[str]) -> None:
+    async def index() -> None:
+        try:
+            await run_in_threadpool(doc_index.add_document, user_id, digest, filename, pages)
+        except Exception as exc:
+            logger.warning("Could not index %s for %s: %s", filename, user_id, exc)
+
+    task = asyncio.create_task(index())
+    _indexing.add(task)
+    task.add_done_callback(_indexing.discard)
+
+
+async def _summarize_file(
+    file_path,
+    digest: str,
+    filename: str,
+    slots: asyncio.Semaphore | None = None,
+    user_id: str | None = None,
+) -> str:
+    """Summarizes a spooled upload, adds it to ``user_id``'s document index and deletes it.
+
+    Extraction and summarization are pipelined, so ``slots`` bounds both.
+    """
+    try:
+        # Pages to index; None when there is no user or the document is indexed already.
+        pages: list[str] | None = None
+        if user_id and not await run_in_threadpool(doc_index.has_document, user_id, digest):
+            pages = []
+        # Whether ``pages`` were collected while summarizing this very upload.
+        collected = False
+
+        async def compute() -> str:
+            nonlocal collected
+            # The summarization is shared with identical uploads and may
+            # outlive this request, so it reads its own link to the file.
+            work_path = file_path.with_name(f"{uuid.uuid4().hex}{file_path.suffix}")
+            try:
+                os.link(file_path, work_path)
+                document = aiter_pages(work_path)
+                if pages is not None:
+                    collected = True
+                    document = _collect(document, pages)
+                async with slots or nullcontext():
+                    summary = await summarize_pages(document, context=f"from the file {filename}")
+            except (Overloaded, DeadlineExceeded):
+                raise
+            except Exception as e:
+                logger.warning("Error extracting text from %s: %s", filename, e)
+                raise HTTPException(
+                    status_code=500, detail=f"Error: Could not process the file {filename}."
+                )
+            finally:
+                work_path.unlink(missing_ok=True)
+            if summary.startswith("Model unavailable"):
+                raise HTTPException(status_code=502, detail=summary)
+            return summary
+
+        summary = await summary_cache.get_or_compute(file_key(digest), compute)
+        if pages is not None and not collected:
+            # The summary came from the cache or another request: extract
+            # our own copy for the index.
+            try:
+                async with slots or nullcontext():
+                    pages.extend([page async for page in aiter_pages(file_path)])
+            except ExtractionError as exc:
+                logger.warning("Could not extract %s for indexing: %s", filename, exc)
+                pages = None
+    finally:
+        file_path.unlink(missing_ok=True)
+    if pages:
+        _index_in_background(user_id, digest, filename, pages)
+    return summary
+
 
 @app.post("/api/process-url", response_model=SummaryResponse)
-def process_url(payload: UrlRequest):
-    """Processes a URL, extracts text, and returns a summary."""
+async def process_url(payload: UrlRequest):
     if not payload.url:
         raise HTTPException(status_code=400, detail="URL is required")
-
-    text = extract_text_from_url(payload.url)
-    if text.startswith("Error:"):
-        raise HTTPException(status_code=500, detail=text)
-
-    summary = summarize_text(text, context=f"from the URL {payload.url}")
-    if summary.startswith("Model unavailable"):
-        raise HTTPException(status_code=502, detail=summary)
-
-    return SummaryResponse(summary=summary)
+    scheduler.use(Priority.BULK)
+    return SummaryResponse(summary=await _summarize_url(payload.url))
 
 
 @app.post("/api/upload-file", response_model=SummaryResponse)
-async def upload_file(file: UploadFile = File(...)):
-    """Processes an uploaded file, extracts text, and returns a summary."""
+async def upload_file(file: UploadFile = File(...), userId: str | None = Form(None)):
+    """Summarizes a document; with ``userId`` it is also indexed for that user's chats."""
     if not file:
         raise HTTPException(status_code=400, detail="No file uploaded")
+    scheduler.use(Priority.BULK)
+    file_path, digest = await spool_upload(file)
+    summary = await _summarize_file(file_path, digest, file.filename, user_id=userId)
+    return SummaryResponse(summary=summary)
 
-    temp_dir = Path("temp_uploads")
-    temp_dir.mkdir(exist_ok=True)
-    file_path = temp_dir / file.filename
-
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
-
-    text = extract_text_from_file(file_path)
-    file_path.unlink(missing_ok=True)
 
-    if text.startswith("Error:"):
-        raise HTTPException(status_code=500, detail=text)
+@app.post("/api/process-batch")
+async def process_batch(
+    urls: list[str] = Form(default=[]),
+    files: list[UploadFile] = File(default=[]),
+    userId: str | None = Form(None),
+):
+    """Summarizes several URLs and files, streaming results as NDJSON.
+
+    Each line is ``{"index", "kind", "source", "summary"}`` or, for an item
+    that failed, ``{"index", "kind", "source", "status", "error"}``, in
+    completion order; ``index`` is the item's position with URLs first.  A
+    final ``{"done": true, "ok", "failed"}`` line ends the stream.  Fetching,
+    file extraction and summarization each run with bounded concurrency, so
+    one slow site only holds up its own item.  With ``userId`` the files are
+    also indexed for that user's chats, as in ``/api/upload-file``.
+    """
+    urls = [url.strip() for url in urls if url.strip()]
+    if not urls and not files:
+        raise HTTPException(status_code=400, detail="Provide at least one URL or file")
+    if len(urls) + len(files) > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BATCH_ITEMS} items per batch"
+        )
+    scheduler.use(Priority.BULK)
+    spooled = []
+    try:
+        for file in files:
+            spooled.append(await spool_upload(file))
+    except BaseException:
+        for path, _ in spooled:
+            path.unlink(missing_ok=True)
+        raise
+
+    fetch_slots = asyncio.Semaphore(BATCH_FETCH_CONCURRENCY)
+    extract_slots = asyncio.Semaphore(BATCH_EXTRACT_CONCURRENCY)
+    summarize_slots = asyncio.Semaphore(BATCH_SUMMARIZE_CONCURRENCY)
+
+    started: set[int] = set()
+
+    async def run(index: int, kind: str, source: str, work) -> dict:
+        started.add(index)
+        item = {"index": index, "kind": kind, "source": source}
+        try:
+            item["summary"] = await work()
+        except HTTPException as exc:
+            item.update(status=exc.status_code, error=exc.detail)
+        except Overloaded as exc:
+            item.update(status=503, error=f"Server busy: {exc}")
+        except DeadlineExceeded as exc:
+            item.update(status=504, error=str(exc))
+        except Exception as exc:
+            logger.warning("Batch item %s (%s) failed: %s", index, source, exc, exc_info=True)
+            item.update(status=500, error=f"Error: Could not process {source}.")
+        return item
+
+    def url_item(url: str):
+        return lambda: _summarize_url(url, fetch_slots, summarize_slots)
+
+    def file_item(path, digest: str, filename: str):
+        return lambda: _summarize_file(path, digest, filename, extract_slots, userId)
+
+    # Started now, so items progress even before the client reads the stream.
+    tasks = [
+        asyncio.ensure_future(run(i, "url", url, url_item(url))) for i, url in enumerate(urls)
+    ]
+    tasks += [
+        asyncio.ensure_future(
+            run(len(urls) + i, "file", file.filename, file_item(path, digest, file.filename))
+        )
+        for i, (file, (path, digest)) in enumerate(zip(files, spooled))
+    ]
+
+    async def lines():
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                failed += "error" in item
+                yield json.dumps(item) + "\n"
+            yield json.dumps({"done": True, "ok": len(tasks) - failed, "failed": failed}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Started items clean up after themselves.
+            for i, (path, _) in enumerate(spooled, start=len(urls)):
+                if i not in started:
+                    path.unlink(missing_ok=True)
+
+    return StreamingResponse(
+        lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"}
+    )
+
+
+async def _analyze_snapshot(image_data: bytes) -> str:
+    """Normalizes the image off the event loop, then analyzes it unless a
+    near-identical snapshot was analyzed recently."""
+    try:
+        image = await run_in_threadpool(images.prepare, image_data)
+    except images.InvalidImage as exc:
+        raise HTTPException(status_code=415, detail=str(exc))
 
-    summary = summarize_text(text, context=f"from the file {file.filename}")
-    if summary.startswith("Model unavailable"):
-        raise HTTPException(status_code=502, detail=summary)
+    async def compute() -> str:
+        summary = await analyze_image_async(
+            image.data, prompt="Describe the content of this image.", mime_type=image.mime_type
+        )
+        if summary.startswith("Error:"):
+            raise HTTPException(status_code=500, detail=summary)
+        return summary
 
-    return SummaryResponse(summary=summary)
+    return await images.snapshot_cache.get_or_compute(image.dhash, compute)
 
 
 @app.post("/api/process-snapshot", response_model=SummaryResponse)
-def process_snapshot(payload: SnapshotRequest):
-    """Processes a base64 image snapshot, analyzes it, and returns a summary."""
+async def process_snapshot(payload: SnapshotRequest):
     if not payload.image:
         raise HTTPException(status_code=400, detail="No image data provided")
-
+    scheduler.use(Priority.SNAPSHOT)
     try:
-        header, encoded = payload.image.split(",", 1)
+        _, encoded = payload.image.split(",", 1)
         image_data = base64.b64decode(encoded)
     except (ValueError, TypeError):
         raise HTTPException(status_code=400, detail="Invalid base64 image format")
-
-    summary = analyze_image(image_data, prompt="Describe the content of this image.")
-    if summary.startswith("Error:"):
-        raise HTTPException(status_code=500, detail=summary)
-
-    return SummaryResponse(summary=summary)
+    return SummaryResponse(summary=await _analyze_snapshot(image_data))
+
+
+@app.post("/api/process-snapshot/raw", response_model=SummaryResponse)
+async def process_snapshot_raw(request: Request):
+    """Analyzes a snapshot sent as raw image bytes or as an ``image`` multipart field.
+
+    Skips the base64 data URL used by ``/api/process-snapshot``, which inflates
+    the payload by a third and has to be decoded again here.  The declared
+    content type is ignored (cameras often send ``application/octet-stream``):
+    the format is detected from the bytes, and anything that does not decode
+    as a supported image is answered with 415.
+    """
+    scheduler.use(Priority.SNAPSHOT)
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("image")
+        if not isinstance(upload, FormFile):
+            raise HTTPException(status_code=400, detail="No image data provided")
+        image_data = await upload.read()
+    else:
+        image_data = await read_body(request, MAX_SNAPSHOT_BYTES)
+    if not image_data:
+        raise HTTPException(status_code=400, detail="No image data provided")
+    return SummaryResponse(summary=await _analyze_snapshot(image_data))
@@ -0,0 +1,213 @@
+"""Token-budgeted conversation history for companion prompts.
+
+The most recent turns are packed, newest first, into a fixed token budget
+(long turns are truncated).  Turns that no longer fit are represented by a
+rolling summary instead.  The summary is updated incrementally in a
+background task: once at least ``CONTEXT_FOLD_MIN_TOKENS`` of turns have
+fallen out of the window since the last update, they are folded into the
+previous summary; until then they are sent verbatim.  Requests never wait
+for an update; they use whatever summary is current.  Prompt size therefore
+stays bounded (by ``CONTEXT_TOKENS`` plus ``CONTEXT_FOLD_MIN_TOKENS``)
+however long the conversation runs, at about one summary call per
+``CONTEXT_FOLD_MIN_TOKENS`` of conversation.
+
+Rolling summaries need a stable conversation key, i.e. a server-side
+session (see ``sessions``).  History sent by the client is usually a sliding
+window whose older turns the client has already dropped, so it is only
+packed into the budget.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import deadline
+import scheduler
+from llm_gateway import call_model_async
+from scheduler import Priority
+from summarizer import estimate_tokens
+
+logger = logging.getLogger("conversation")
+
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "1200"))
+# Part of the budget reserved for the rolling summary once there is one.
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "300"))
+TURN_TOKENS = 400
+# Turns that left the window are folded into the summary only once this much
+# of them has built up, so a long conversation does not cost a summary call
+# per turn.
+FOLD_MIN_TOKENS = int(os.getenv("CONTEXT_FOLD_MIN_TOKENS", str(2 * CONTEXT_SUMMARY_TOKENS)))
+# Most text folded into the summary by one update.
+FOLD_TOKENS = 3000
+MAX_CONVERSATIONS = 10_000
+
+ROLLING_SUMMARY_CFG = {
+    "temperature": 0.2,
+    "max_output_tokens": CONTEXT_SUMMARY_TOKENS,
+}
+
+
+def _truncate(text: str, tokens: int) -> str:
+    limit = tokens * 4
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+def turn_text(turn: dict) -> str:
+    return f"{turn.get('role', 'user')}: {turn.get('content', '')}"
+
+
+def chain_digest(turns: list[dict], seed: str = "") -> str:
+    """Digest of ``turns`` continuing from ``seed``, the digest of the turns before them."""
+    digest = seed
+    for turn in turns:
+        digest = hashlib.sha256(f"{digest}\0{turn_text(turn)}".encode("utf-8")).hexdigest()
+    return digest
+
+
+def _tokens(turns: list[dict]) -> int:
+    return sum(estimate_tokens(_truncate(turn_text(t), TURN_TOKENS)) for t in turns)
+
+
+def pack_recent(turns: list[dict], budget: int) -> tuple[int, list[str]]:
+    """Newest turns that fit in ``budget`` tokens: ``(index of the first, lines)``."""
+    lines: list[str] = []
+    used = 0
+    start = len(turns)
+    for i in range(len(turns) - 1, -1, -1):
+        line = _truncate(turn_text(turns[i]), TURN_TOKENS)
+        tokens = estimate_tokens(line)
+        if used + tokens > budget:
+            break
+        lines.append(line)
+        used += tokens
+        start = i
+    lines.reverse()
+    return start, lines
+
+
+def fold_prompt(summary: str | None, turns: list[dict]) -> str:
+    text = "\n".join(turn_text(t) for t in turns)
+    if estimate_tokens(text) > FOLD_TOKENS:
+        text = "…" + text[-FOLD_TOKENS * 4:]
+    previous = f"Summary so far:\n{summary}\n\n" if summary else ""
+    return (
+        "Keep a running summary of a tutoring conversation. "
+        "Update it with the new turns below, keeping what the student asked, "
+        "what was explained and anything still open. Plain text, at most "
+        f"{CONTEXT_SUMMARY_TOKENS * 3 // 4} words.\n\n{previous}New turns:\n{text}"
+    )
+
+
+@dataclass
+class _Summary:
+    covered: int  # number of leading turns folded in, counted from the first ever
+    digest: str  # chain digest of those turns
+    text: str
+
+
+class RollingSummaries:
+    """Per-conversation rolling summaries, updated off the request path."""
+
+    def __init__(self, max_entries: int = MAX_CONVERSATIONS):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, _Summary] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def current(
+        self, key: str, older: list[dict], offset: int = 0, seed: str = ""
+    ) -> _Summary | None:
+        """The stored summary if it covers a prefix of ``older``.
+
+        ``older[0]`` is turn number ``offset`` of the conversation and ``seed``
+        the chain digest of the turns before it.
+        """
+        entry = self._entries.get(key)
+        if entry is None or not offset <= entry.covered <= offset + len(older):
+            return None
+        if entry.digest != chain_digest(older[:entry.covered - offset], seed):
+            return None  # the client rewrote history
+        self._entries.move_to_end(key)
+        return entry
+
+    def schedule(
+        self,
+        key: str,
+        older: list[dict],
+        entry: _Summary | None,
+        offset: int = 0,
+        seed: str = "",
+    ) -> None:
+        """Starts folding the turns ``entry`` does not cover yet, unless already running."""
+        if entry is not None and entry.covered == offset + len(older):
+            return
+        if key in self._inflight:
+            return
+        task = asyncio.get_running_loop().create_task(
+            self._fold(key, list(older), entry, offset, seed)
+        )
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+    async def _fold(
+        self, key: str, older: list[dict], entry: _Summary | None, offset: int, seed: str
+    ) -> None:
+        # Runs in a copy of the request's context: detach from its deadline
+        # and queue behind interactive traffic.
+        deadline.set_timeout(None)
+        scheduler.use(Priority.BULK)
+        start = entry.covered - offset if entry else 0
+        try:
+            text = await call_model_async(
+                fold_prompt(entry.text if entry else None, older[start:]),
+                cfg=ROLLING_SUMMARY_CFG,
+            )
+        except Exception as exc:  # pragma: no cover - external service
+            logger.warning("Rolling summary update failed: %s", exc)
+            return
+        if not text or text.startswith("Model unavailable"):
+            return
+        self._entries[key] = _Summary(offset + len(older), chain_digest(older, seed), text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+summaries = RollingSummaries()
+
+
+def history_text(
+    turns: list[dict] | None,
+    key: str | None = None,
+    budget: int = CONTEXT_TOKENS,
+    offset: int = 0,
+    seed: str = "",
+) -> str | None:
+    """Prompt history for ``turns``: the newest turns in budget, preceded by a
+    rolling summary of the older ones when ``key`` names the conversation.
+
+    ``offset`` and ``seed`` describe turns already dropped from the front of
+    ``turns`` (see ``RollingSummaries.current``).  Must be called from the
+    event loop, which runs the summary updates.
+    """
+    if not turns:
+        return None
+    start, lines = pack_recent(turns, budget)
+    if start > 0 and key is not None:
+        # Make room for the summary by dropping the oldest packed turns.
+        start, lines = pack_recent(turns, budget - CONTEXT_SUMMARY_TOKENS)
+        older = turns[:start]
+        entry = summaries.current(key, older, offset, seed)
+        unfolded = older[entry.covered - offset:] if entry else older
+        if _tokens(unfolded) >= FOLD_MIN_TOKENS:
+            summaries.schedule(key, older, entry, offset, seed)
+        # Turns not folded in yet go in as they are (the newest of them, if
+        # an update is still running or failed).
+        _, tail = pack_recent(unfolded, FOLD_MIN_TOKENS)
+        lines = tail + lines
+        if entry is not None:
+            summary = _truncate(entry.text, CONTEXT_SUMMARY_TOKENS)
+            lines.insert(0, f"Earlier in this conversation (summary): {summary}")
+    return "\n".join(lines) or None
@@ -1,46 +1,49 @@
-import json
+"""Prompting, model calls and content helpers shared by the API and the CLI.
+
+Importing this module is cheap: the Gemini client, the HTML parser and the
+topic database are loaded on first use.  Long-running processes call
+``startup`` once (optionally in the background) so that cost is paid before
+the first request instead of during it.
+"""
+
+import logging
 import os
 import random
 import re
-import sys
+import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
-import base64
-import io
+from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
-import google.generativeai as genai
-from PIL import Image
-import requests
-from bs4 import BeautifulSoup
-import pypdf
-import docx
-import pptx
-
 
-def _suppress_warnings():
-    class HideStderr:
-        def __enter__(self):
-            self._original = sys.stderr
-            sys.stderr = open(os.devnull, "w")
+import extraction
+import fetcher
+import images
+import metrics
+from topic_store import TopicStore, open_store
+from response_cache import adaptive_cache, adaptive_cache_key, is_cacheable_reply
 
-        def __exit__(self, exc_type, exc_val, exc_tb):
-            sys.stderr.close()
-            sys.stderr = self._original
+if TYPE_CHECKING:  # imported on first use, see _client()
+    import google.generativeai as genai
 
-    return HideStderr
 
+# Silence the gRPC/absl start-up chatter; genai (and with it grpc) is only
+# imported later, in _client().
+os.environ.setdefault("GRPC_VERBOSITY", "NONE")
+os.environ.setdefault("GLOG_minloglevel", "3")
 
-HideStderr = _suppress_warnings()
 
+logger = logging.getLogger("core")
 
 load_dotenv()
+# "fake" swaps Gemini for the local stand-in in fake_llm (no key or quota needed).
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
 API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
+if LLM_BACKEND != "fake" and not API_KEY:
     raise ValueError("GEMINI_API_KEY missing. Please set it in the .env file.")
 
-genai.configure(api_key=API_KEY)
-
 PRIMARY_MODEL = "gemini-2.5-flash"
 FALLBACK_MODEL = "gemini-2.0-flash-lite"
 GEN_CFG = {
@@ -50,44 +53,169 @@ GEN_CFG = {
 }
 
 MEM_PATH = Path("neuro_memory.json")
-memory = {"topics": []}
-if MEM_PATH.exists():
-    try:
-        memory = json.loads(MEM_PATH.read_text())
-    except json.JSONDecodeError:
-        memory = {"topics": []}
+TOPIC_DB_PATH = Path(os.getenv("TOPIC_DB_PATH", "neuro_memory.db"))
+
+_init_lock = threading.RLock()
+_genai = None
+_topics: TopicStore | None = None
 
 
-def _persist_memory():
-    MEM_PATH.write_text(json.dumps(memory, indent=2))
+def _client():
+    """The configured ``google.generativeai`` module, imported on first use."""
+    global _genai
+    if _genai is None:
+        with _init_lock:
+            if _genai is None:
+                import google.generativeai as genai
 
+                genai.configure(api_key=API_KEY)
+                _genai = genai
+    return _genai
 
-def add_topic(topic: str) -> None:
+
+def topic_store() -> TopicStore:
+    global _topics
+    if _topics is None:
+        with _init_lock:
+            if _topics is None:
+                _topics = open_store(TOPIC_DB_PATH, legacy_json=MEM_PATH)
+    return _topics
+
+
+def add_topic(topic: str, user_id: str | None = None) -> None:
     topic = (topic or "")[:60]
     if not topic:
         return
-    if topic not in memory["topics"]:
-        memory["topics"].append(topic)
-    memory["topics"] = memory["topics"][-200:]
-    _persist_memory()
+    topic_store().add(user_id or "", topic)
+
+
+def get_topics(user_id: str | None = None) -> list[str]:
+    return topic_store().topics(user_id or "")
 
 
 def clean(text: str) -> str:
     return re.sub(r"[#*`]+", "", text or "").strip()
 
 
+class StreamCleaner:
+    """Applies ``clean`` incrementally to a stream of text chunks.
+
+    Markdown markers are dropped chunk by chunk; trailing whitespace is held
+    back until more text arrives so the joined output equals ``clean`` of the
+    joined input.
+    """
+
+    def __init__(self):
+        self._started = False
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        text = re.sub(r"[#*`]+", "", chunk or "")
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+        text = self._pending + text
+        emitted = text.rstrip()
+        self._pending = text[len(emitted):]
+        return emitted
+
+
+SHORT_CFG = {"max_output_tokens": 300}
+
+_models: dict[str, "genai.GenerativeModel"] = {}
+
+
+def get_model(name: str) -> "genai.GenerativeModel":
+    """Returns a shared client for ``name``; generation config is passed per call."""
+    gen = _models.get(name)
+    if gen is None:
+        if LLM_BACKEND == "fake":
+            from fake_llm import FakeModel
+
+            return _models.setdefault(name, FakeModel(name))
+        genai = _client()
+        gen = _models.setdefault(name, genai.GenerativeModel(name))
+    return gen
+
+
+def startup(warm_extraction: bool = False, background: bool = False) -> threading.Thread | None:
+    """Pays first-use costs up front.
+
+    Creates the model clients, opens the topic store, imports the HTML parser
+    and, with ``warm_extraction``, starts the extraction workers.  With
+    ``background=True`` this runs in a daemon thread that is returned; a
+    request that needs one of these first simply waits on the same lock.
+    """
+    if background:
+        thread = threading.Thread(
+            target=startup, args=(warm_extraction,), name="core-startup", daemon=True
+        )
+        thread.start()
+        return thread
+    get_model(PRIMARY_MODEL)
+    get_model(FALLBACK_MODEL)
+    topic_store()
+    import bs4  # noqa: F401  (first import is the slow part)
+
+    if warm_extraction:
+        extraction.warmup()
+    return None
+
+
+def shutdown() -> None:
+    """Flushes queued topic writes and stops the extraction workers."""
+    if _topics is not None:
+        _topics.flush()
+    extraction.shutdown()
+
+
+def record_call(model: str, mode: str, elapsed: float, exc: Exception | None = None) -> None:
+    """Records one finished model call in the ``llm_*`` metrics."""
+    metrics.llm_request_seconds.observe(
+        elapsed, model=model, mode=mode, outcome="ok" if exc is None else "error"
+    )
+    if exc is not None:
+        kind = "rate_limited" if "429" in str(exc) else "error"
+        metrics.llm_errors.inc(model=model, kind=kind)
+
+
+def record_usage(model: str, response) -> None:
+    """Adds the token counts reported with ``response`` to ``llm_tokens``."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    reply_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    if prompt_tokens:
+        metrics.llm_tokens.inc(prompt_tokens, model=model, kind="prompt")
+    if reply_tokens:
+        metrics.llm_tokens.inc(reply_tokens, model=model, kind="response")
+
+
+def _generate(model: str, contents, cfg: dict | None = None):
+    start = time.monotonic()
+    try:
+        result = get_model(model).generate_content(contents, generation_config=cfg)
+    except Exception as exc:
+        record_call(model, "call", time.monotonic() - start, exc)
+        raise
+    record_call(model, "call", time.monotonic() - start)
+    record_usage(model, result)
+    return result
+
+
 def call_model(prompt: str, model: str = PRIMARY_MODEL, cfg: dict | None = None) -> str:
     cfg = cfg or GEN_CFG
     last_error = None
 
     try:
-        with HideStderr():
-            gen = genai.GenerativeModel(model, generation_config=cfg)
-            result = gen.generate_content(prompt)
+        result = _generate(model, prompt, cfg)
         reply = clean(getattr(result, "text", "") or "")
-        finish_reason = getattr(result, "finish_reason", "unknown")
-        print(
-            f"[DEBUG] Model: {model}, Finish reason: {finish_reason}, Reply length: {len(reply)}"
+        logger.debug(
+            "Model: %s, Finish reason: %s, Reply length: %s",
+            model, getattr(result, "finish_reason", "unknown"), len(reply),
         )
         if reply:
             return reply
@@ -97,10 +225,9 @@ def call_model(prompt: str, model: str = PRIMARY_MODEL, cfg: dict | None = None)
             time.sleep(1.2)
 
     if last_error:
+        metrics.llm_fallbacks.inc(reason="fallback")
         try:
-            with HideStderr():
-                gen = genai.GenerativeModel(FALLBACK_MODEL, generation_config=cfg)
-                result = gen.generate_content(prompt)
+            result = _generate(FALLBACK_MODEL, prompt, cfg)
             reply = clean(getattr(result, "text", "") or "")
             if reply:
                 return reply
@@ -108,11 +235,9 @@ def call_model(prompt: str, model: str = PRIMARY_MODEL, cfg: dict | None = None)
             last_error = exc
 
     if last_error:
+        metrics.llm_fallbacks.inc(reason="short_prompt")
         try:
-            with HideStderr():
-                short_cfg = {"max_output_tokens": 300}
-                gen = genai.GenerativeModel(FALLBACK_MODEL, generation_config=short_cfg)
-                result = gen.generate_content("Short: " + prompt[:200])
+            result = _generate(FALLBACK_MODEL, short_prompt(prompt), SHORT_CFG)
             reply = clean(getattr(result, "text", "") or "")
             if reply:
                 return reply
@@ -122,13 +247,43 @@ def call_model(prompt: str, model: str = PRIMARY_MODEL, cfg: dict | None = None)
     return f"Model unavailable: {last_error or 'unknown error'}"
 
 
-def adaptive(
-    profile: str, state: str, user_input: str, history: str | None = None
-) -> str:
+def short_prompt(prompt: str) -> str:
+    """Last-resort prompt used when both models failed on the full prompt."""
+    return "Short: " + prompt[:200]
+
+
+GREETING_REPLY = "Hey! How can I help today?"
+
+
+def is_greeting(user_input: str) -> bool:
     # Lightweight casual greeting for very short inputs
     ui = (user_input or "").strip().lower()
-    if ui in {"hi", "hii", "hello", "hey", "yo"} or len(ui) <= 3:
-        return "Hey! How can I help today?"
+    return ui in {"hi", "hii", "hello", "hey", "yo"} or len(ui) <= 3
+
+
+def wants_analogy(state: str, user_input: str) -> bool:
+    """Rolls the dice for the occasional "create an analogy" exercise."""
+    if state in ("attention", "drowsiness"):
+        return False
+    ask_analogy = random.random() < 0.20
+    conceptual = any(
+        word in (user_input or "").lower()
+        for word in ["what", "why", "how", "explain", "define", "concept"]
+    )
+    return ask_analogy and conceptual
+
+
+def build_adaptive_prompt(
+    profile: str,
+    state: str,
+    user_input: str,
+    history: str | None = None,
+    ask_analogy: bool = False,
+    context: str | None = None,
+) -> str | None:
+    """Builds the companion prompt, or returns None for a casual greeting."""
+    if is_greeting(user_input):
+        return None
 
     base = f"""
 You are the NeuroAdaptive Learning Companion.
@@ -143,6 +298,12 @@ Respond with SHORT, CLEAN TEXT. NO markdown.
     if history:
         base = base.replace("User asked", f"History:\n{history}\n\nUser asked")
 
+    if context:
+        base = base.replace(
+            "User asked",
+            f"From the student's own documents (use if relevant):\n{context}\n\nUser asked",
+        )
+
     if state == "attention":
         base += """
 Give:
@@ -161,90 +322,120 @@ Give:
 """
 
     else:
-        ask_analogy = random.random() < 0.20
-        conceptual = any(
-            word in user_input.lower()
-            for word in ["what", "why", "how", "explain", "define", "concept"]
-        )
-
         base += "Give:\n1) Balanced explanation.\n"
 
-        if ask_analogy and conceptual:
+        if ask_analogy:
             base += "2) Ask user to create an analogy.\n"
         else:
             base += "2) Do NOT ask for analogy.\n"
 
-    return call_model(base)
+    return base
+
+
+def adaptive(
+    profile: str,
+    state: str,
+    user_input: str,
+    history: str | None = None,
+    context: str | None = None,
+) -> str:
+    if is_greeting(user_input):
+        return GREETING_REPLY
+    # The analogy exercise is randomized, so those replies bypass the cache.
+    ask_analogy = wants_analogy(state, user_input)
+    key = (
+        None if ask_analogy
+        else adaptive_cache_key(profile, state, user_input, history, context)
+    )
+    if key:
+        cached = adaptive_cache.get(key)
+        if cached is not None:
+            return cached
+    reply = call_model(
+        build_adaptive_prompt(profile, state, user_input, history, ask_analogy, context)
+    )
+    if key and is_cacheable_reply(reply):
+        adaptive_cache.put(key, reply)
+    return reply
+
+
+# Use a generation config optimized for summarization
+SUMMARY_CFG = {
+    "temperature": 0.3,
+    "top_p": 0.8,
+    "max_output_tokens": 250,
+}
+
+
+def summary_prompt(text: str, context: str = "") -> str:
+    return f"Summarize the following text. {context}:\n\n{text}"
 
 
 def summarize_text(text: str, context: str = "") -> str:
     """Generates a summary for a given text using the LLM."""
-    prompt = f"Summarize the following text. {context}:\n\n{text}"
-    # Use a generation config optimized for summarization
-    summary_cfg = {
-        "temperature": 0.3,
-        "top_p": 0.8,
-        "max_output_tokens": 250,
-    }
-    return call_model(prompt, cfg=summary_cfg)
+    return call_model(summary_prompt(text, context), cfg=SUMMARY_CFG)
+
+
+# Parsed page text by body digest, so a 304 revalidation skips the HTML parse.
+_parsed_pages: OrderedDict[str, str] = OrderedDict()
+_PARSED_PAGES_MAX = 128
+
+
+def _html_to_text(body: bytes) -> str:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(body, 'html.parser')
+    # Remove script and style elements
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    # Get text
+    text = soup.get_text()
+    # Break into lines and remove leading/trailing space on each
+    lines = (line.strip() for line in text.splitlines())
+    # Break multi-headlines into a line each
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    # Drop blank lines
+    return '\n'.join(chunk for chunk in chunks if chunk)
 
 
 def extract_text_from_url(url: str) -> str:
     """Extracts textual content from a URL."""
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        # Remove script and style elements
-        for script_or_style in soup(["script", "style"]):
-            script_or_style.decompose()
-        # Get text
-        text = soup.get_text()
-        # Break into lines and remove leading/trailing space on each
-        lines = (line.strip() for line in text.splitlines())
-        # Break multi-headlines into a line each
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        # Drop blank lines
-        return '\n'.join(chunk for chunk in chunks if chunk)
-    except requests.RequestException as e:
+        result = fetcher.fetch(url)
+    except fetcher.FetchError as e:
         print(f"Error fetching URL {url}: {e}")
         return f"Error: Could not retrieve content from the URL."
+    text = _parsed_pages.get(result.digest)
+    if text is None:
+        text = _html_to_text(result.body)
+        _parsed_pages[result.digest] = text
+        while len(_parsed_pages) > _PARSED_PAGES_MAX:
+            _parsed_pages.popitem(last=False)
+    return text
 
 
 def extract_text_from_file(file_path: Path) -> str:
     """Extracts text from various file types."""
-    ext = file_path.suffix.lower()
     try:
-        if ext == ".pdf":
-            reader = pypdf.PdfReader(file_path)
-            return "\n".join(page.extract_text() or "" for page in reader.pages)
-        elif ext == ".docx":
-            doc = docx.Document(file_path)
-            return "\n".join(para.text for para in doc.paragraphs)
-        elif ext == ".pptx":
-            pres = pptx.Presentation(file_path)
-            return "\n".join(
-                shape.text
-                for slide in pres.slides
-                for shape in pres.shapes
-                if hasattr(shape, "text")
-            )
-        elif ext in [".jpg", ".jpeg", ".png", ".webp"]:
-            # For images, we'll use the multimodal capabilities of the model
-            # so we just return a marker. The calling function will handle the image data.
-            return f"[Image file: {file_path.name}]"
-        else: # Plain text
-            return file_path.read_text(errors="ignore")
+        return extraction.extract_text(file_path)
     except Exception as e:
         print(f"Error extracting text from {file_path}: {e}")
         return f"Error: Could not process the file {file_path.name}."
 
-def analyze_image(image_data: bytes, prompt: str) -> str:
-    """Analyzes an image using the multimodal model."""
+def analyze_image(image_data: bytes, prompt: str, mime_type: str | None = None) -> str:
+    """Analyzes an image using the multimodal model.
+
+    The image is downscaled and re-encoded first; ``mime_type`` is only used
+    for bytes Pillow cannot decode.
+    """
+    try:
+        image = images.prepare(image_data)
+        image_data, mime_type = image.data, image.mime_type
+    except images.InvalidImage:
+        mime_type = mime_type or "image/jpeg"
     try:
-        image_parts = [{"mime_type": "image/jpeg", "data": image_data}]
-        model = genai.GenerativeModel(PRIMARY_MODEL)
-        response = model.generate_content([prompt, *image_parts])
+        image_parts = [{"mime_type": mime_type, "data": image_data}]
+        response = _generate(PRIMARY_MODEL, [prompt, *image_parts])
         return clean(response.text)
     except Exception as e:
         print(f"Image analysis error: {e}")
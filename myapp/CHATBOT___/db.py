@@ -0,0 +1,12 @@
+"""Shared SQLite connection setup for the local stores."""
+
+import sqlite3
+from pathlib import Path
+
+
+def connect(path: Path, timeout: float = 5.0) -> sqlite3.Connection:
+    """Opens an autocommit connection in WAL mode; callers manage transactions explicitly."""
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
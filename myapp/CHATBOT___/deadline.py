@@ -0,0 +1,127 @@
+"""Per-request deadlines shared by every layer below the HTTP API.
+
+``DeadlineMiddleware`` gives each request a deadline, taken from the
+``X-Request-Timeout`` header (seconds) and capped by the server default for
+its route, and keeps it in a context variable.  Retry loops, backoff sleeps,
+the model fallback chain and URL fetches consult it through ``check``,
+``sleep`` and ``timeout`` and skip work that can no longer finish in time.
+
+The middleware also watches the connection once the request body has been
+read: when the client disconnects, the request's task is cancelled, which
+cancels its outstanding model calls instead of letting them run for nobody.
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+BULK_REQUEST_TIMEOUT = float(os.getenv("BULK_REQUEST_TIMEOUT", "300"))
+TIMEOUT_HEADER = b"x-request-timeout"
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "request_deadline", default=None
+)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the current request has no time left for the next step."""
+
+
+def set_timeout(seconds: float | None) -> contextvars.Token:
+    """Starts a deadline ``seconds`` from now for the current context (None clears it)."""
+    return _deadline.set(None if seconds is None else time.monotonic() + seconds)
+
+
+def remaining() -> float | None:
+    """Seconds left before the deadline, or None when there is no deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check(needed: float = 0.0) -> None:
+    """Raises ``DeadlineExceeded`` unless more than ``needed`` seconds are left."""
+    left = remaining()
+    if left is not None and left <= needed:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def timeout(default: float) -> float:
+    """``default`` shortened to the time left, for I/O timeouts."""
+    left = remaining()
+    return default if left is None else max(min(default, left), 0.001)
+
+
+async def sleep(seconds: float) -> None:
+    """Sleeps, unless the deadline would pass first (then raises straight away)."""
+    check(seconds)
+    await asyncio.sleep(seconds)
+
+
+class DeadlineMiddleware:
+    """ASGI middleware setting the request deadline and cancelling abandoned requests."""
+
+    def __init__(self, app, default: float, limits: dict[str, float] | None = None):
+        self.app = app
+        self.default = default
+        # Longest prefix first so more specific routes win.
+        self.limits = sorted((limits or {}).items(), key=lambda kv: -len(kv[0]))
+
+    def _timeout(self, scope) -> float:
+        limit = next(
+            (t for prefix, t in self.limits if scope["path"].startswith(prefix)), self.default
+        )
+        requested = dict(scope.get("headers") or []).get(TIMEOUT_HEADER)
+        try:
+            requested = float(requested) if requested is not None else None
+        except ValueError:
+            requested = None
+        return min(requested, limit) if requested and requested > 0 else limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        set_timeout(self._timeout(scope))
+
+        body_read = asyncio.Event()
+        messages: asyncio.Queue = asyncio.Queue()
+        disconnected = False
+
+        async def app_receive():
+            if body_read.is_set():
+                return await messages.get()
+            message = await receive()
+            if message["type"] == "http.disconnect" or not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        task = asyncio.ensure_future(self.app(scope, app_receive, send))
+
+        async def watch_disconnect():
+            nonlocal disconnected
+            await body_read.wait()
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    disconnected = True
+                    task.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+            # Nobody is waiting for the response any more.
+        finally:
+            watcher.cancel()
+            if not task.done():
+                task.cancel()
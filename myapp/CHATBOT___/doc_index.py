@@ -0,0 +1,344 @@
+"""Per-user retrieval index over uploaded documents.
+
+Extracted pages are cut into small chunks and indexed in an in-memory
+inverted index scored with BM25, so a chat question pulls only the few
+chunks that match it into the prompt instead of whole documents.  Each
+user's index is persisted as one JSON file under ``RETRIEVAL_DIR`` (chunk
+texts and, if enabled, their vectors; postings are rebuilt on load) and kept
+in memory for the most recently active users.  Several worker processes may
+share ``RETRIEVAL_DIR``: a cached index is reloaded whenever its file has
+been replaced since it was read, and adding a document holds an exclusive
+``flock`` on a per-user lock file for the whole reload-modify-save.
+
+Setting ``RETRIEVAL_EMBEDDER`` to ``"module:callable"`` adds dense vectors
+from a local embedding model: the callable maps a list of strings to a list
+of equal-length float vectors.  Search then fuses the BM25 and cosine
+rankings with reciprocal rank fusion.
+
+Everything here blocks (disk, tokenizing, embedding): call it from a worker
+thread.
+"""
+
+import hashlib
+import importlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable
+
+from metrics import store_seconds
+from summarizer import Chunker, estimate_tokens
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single worker process is assumed
+    fcntl = None
+
+logger = logging.getLogger("doc_index")
+
+RETRIEVAL_DIR = Path(os.getenv("RETRIEVAL_DIR", "doc_index"))
+RETRIEVAL_EMBEDDER = os.getenv("RETRIEVAL_EMBEDDER", "")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+# Token budget for the retrieved chunks in one prompt.
+RETRIEVAL_CONTEXT_TOKENS = int(os.getenv("RETRIEVAL_CONTEXT_TOKENS", "800"))
+CHUNK_TOKENS = 200
+MAX_CHUNKS_PER_USER = int(os.getenv("RETRIEVAL_MAX_CHUNKS", "20000"))
+MAX_LOADED_USERS = 256
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60  # reciprocal rank fusion constant
+
+_WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from had has have how i if in is it its "
+    "me my not of on or so that the their them then there these they this to was what "
+    "when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [w for w in _WORD.findall(text.lower()) if w not in STOPWORDS and len(w) > 1]
+
+
+def _load_embedder(spec: str) -> Callable[[list[str]], list[list[float]]]:
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name or "embed")
+
+
+def _version(path: Path) -> tuple[int, int] | None:
+    """Identifies the current contents of ``path``: a save always replaces the file."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino
+
+
+def _normalize(vector: Iterable[float]) -> list[float]:
+    vector = [float(x) for x in vector]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+@dataclass
+class Hit:
+    document: str  # file name
+    text: str
+    score: float
+
+
+class UserIndex:
+    """BM25 index (plus optional vectors) over one user's documents."""
+
+    def __init__(self):
+        # doc id -> {"name", "added", "chunks": [chunk ids]}
+        self.documents: dict[str, dict] = {}
+        self.chunks: dict[int, tuple[str, str]] = {}  # chunk id -> (doc id, text)
+        self.lengths: dict[int, int] = {}
+        self.vectors: dict[int, list[float]] = {}
+        self.postings: dict[str, dict[int, int]] = {}
+        self.total_length = 0
+        self.next_id = 0
+        self.lock = threading.Lock()
+        # ``_version`` of the file this index was loaded from or saved to.
+        self.version: tuple[int, int] | None = None
+
+    def add(self, doc_id: str, name: str, chunks: list[str], vectors=None) -> None:
+        self.remove(doc_id)
+        ids = []
+        for i, text in enumerate(chunks):
+            chunk_id = self.next_id
+            self.next_id += 1
+            ids.append(chunk_id)
+            self._index(chunk_id, doc_id, text)
+            if vectors is not None:
+                self.vectors[chunk_id] = vectors[i]
+        self.documents[doc_id] = {"name": name, "added": time.time(), "chunks": ids}
+        # Oldest documents go first once the user is over the limit.
+        while len(self.chunks) > MAX_CHUNKS_PER_USER and len(self.documents) > 1:
+            oldest = min(self.documents, key=lambda d: self.documents[d]["added"])
+            self.remove(oldest)
+
+    def _index(self, chunk_id: int, doc_id: str, text: str) -> None:
+        terms = tokenize(text)
+        self.chunks[chunk_id] = (doc_id, text)
+        self.lengths[chunk_id] = len(terms)
+        self.total_length += len(terms)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+
+    def remove(self, doc_id: str) -> None:
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return
+        for chunk_id in document["chunks"]:
+            _, text = self.chunks.pop(chunk_id)
+            self.total_length -= self.lengths.pop(chunk_id)
+            self.vectors.pop(chunk_id, None)
+            for term in set(tokenize(text)):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self.postings[term]
+
+    def bm25(self, query: str) -> dict[int, float]:
+        count = len(self.chunks)
+        if not count:
+            return {}
+        avg_length = self.total_length / count or 1.0
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                norm = 1 - BM25_B + BM25_B * self.lengths[chunk_id] / avg_length
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (
+                    tf + BM25_K1 * norm
+                )
+        return scores
+
+    def dense(self, query_vector: list[float], limit: int) -> dict[int, float]:
+        scored = (
+            (chunk_id, sum(a * b for a, b in zip(query_vector, vector)))
+            for chunk_id, vector in self.vectors.items()
+        )
+        return dict(sorted(scored, key=lambda item: item[1], reverse=True)[:limit])
+
+    def to_json(self) -> dict:
+        return {
+            "documents": {
+                doc_id: {
+                    "name": doc["name"],
+                    "added": doc["added"],
+                    "chunks": [self.chunks[c][1] for c in doc["chunks"]],
+                    "vectors": [self.vectors[c] for c in doc["chunks"]]
+                    if all(c in self.vectors for c in doc["chunks"]) and doc["chunks"]
+                    else None,
+                }
+                for doc_id, doc in self.documents.items()
+            }
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "UserIndex":
+        index = cls()
+        documents = sorted(data.get("documents", {}).items(), key=lambda d: d[1]["added"])
+        for doc_id, doc in documents:
+            index.add(doc_id, doc["name"], doc["chunks"], doc.get("vectors"))
+            index.documents[doc_id]["added"] = doc["added"]
+        return index
+
+
+def _rank(scores: dict[int, float]) -> list[int]:
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class DocumentIndex:
+    """Per-user ``UserIndex``es, loaded on demand and persisted on change."""
+
+    def __init__(self, root: Path, embedder: str | Callable | None = None):
+        self.root = Path(root)
+        # A "module:callable" spec is imported on first use: models are slow to load.
+        self._embedder = embedder or None
+        self._users: OrderedDict[str, UserIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def embedder(self) -> Callable | None:
+        if isinstance(self._embedder, str):
+            with self._lock:
+                if isinstance(self._embedder, str):
+                    self._embedder = _load_embedder(self._embedder)
+        return self._embedder
+
+    def _path(self, user_id: str) -> Path:
+        digest = hashlib.sha256(user_id.encode("utf-8")).hexdigest()
+        return self.root / digest[:2] / f"{digest}.json"
+
+    def _user(self, user_id: str) -> UserIndex:
+        """The user's index, reloaded if another process saved it since it was read."""
+        path = self._path(user_id)
+        version = _version(path)
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None and index.version == version:
+                self._users.move_to_end(user_id)
+                return index
+        with store_seconds.time(store="doc_index", op="load"):
+            try:
+                index = UserIndex.from_json(json.loads(path.read_text()))
+            except FileNotFoundError:
+                index = UserIndex()
+            except (OSError, ValueError, KeyError) as exc:
+                logger.warning("Could not load the document index of %s: %s", user_id, exc)
+                index = UserIndex()
+        index.version = version
+        with self._lock:
+            current = self._users.get(user_id)
+            if current is not None and current.version == version:
+                index = current  # another thread loaded the same file meanwhile
+            else:
+                self._users[user_id] = index
+            self._users.move_to_end(user_id)
+            while len(self._users) > MAX_LOADED_USERS:
+                self._users.popitem(last=False)
+        return index
+
+    @contextmanager
+    def _locked(self, user_id: str):
+        """Serializes changes to one user's index file across threads and processes."""
+        path = self._path(user_id).with_suffix(".lock")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+            yield
+
+    def _save(self, user_id: str, index: UserIndex) -> None:
+        path = self._path(user_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(index.to_json()))
+        os.replace(tmp, path)
+        index.version = _version(path)
+
+    def has_document(self, user_id: str, doc_id: str) -> bool:
+        return doc_id in self._user(user_id).documents
+
+    def add_document(self, user_id: str, doc_id: str, name: str, pages: Iterable[str]) -> int:
+        """Chunks and indexes a document (replacing one with the same id); returns the chunk count."""
+        chunker = Chunker(CHUNK_TOKENS)
+        chunks = [c for page in pages for c in chunker.feed(page)]
+        chunks += list(chunker.flush())
+        with store_seconds.time(store="doc_index", op="add"):
+            embedder = self.embedder
+            vectors = None
+            if embedder is not None and chunks:
+                vectors = [_normalize(v) for v in embedder(chunks)]
+            with self._locked(user_id):
+                index = self._user(user_id)
+                with index.lock:
+                    index.add(doc_id, name, chunks, vectors)
+                    self._save(user_id, index)
+        return len(chunks)
+
+    def search(self, user_id: str, query: str, k: int = RETRIEVAL_TOP_K) -> list[Hit]:
+        index = self._user(user_id)
+        if not index.chunks:
+            return []
+        with store_seconds.time(store="doc_index", op="search"):
+            embedder = self.embedder
+            query_vector = None
+            if embedder is not None and index.vectors:
+                query_vector = _normalize(embedder([query])[0])
+            with index.lock:
+                lexical = index.bm25(query)
+                if query_vector is None:
+                    ranked = _rank(lexical)[:k]
+                    scores = lexical
+                else:
+                    dense = index.dense(query_vector, limit=k * 4)
+                    scores = {}
+                    for ranking in (_rank(lexical)[:k * 4], _rank(dense)):
+                        for rank, chunk_id in enumerate(ranking):
+                            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (RRF_K + rank)
+                    ranked = _rank(scores)[:k]
+                hits = []
+                for chunk_id in ranked:
+                    doc_id, text = index.chunks[chunk_id]
+                    hits.append(Hit(index.documents[doc_id]["name"], text, scores[chunk_id]))
+        return hits
+
+    def context(
+        self,
+        user_id: str,
+        query: str,
+        k: int = RETRIEVAL_TOP_K,
+        budget: int = RETRIEVAL_CONTEXT_TOKENS,
+    ) -> str | None:
+        """The top chunks for ``query`` as prompt text, within ``budget`` tokens."""
+        parts = []
+        used = 0
+        for hit in self.search(user_id, query, k):
+            part = f"[{hit.document}] {hit.text}"
+            cost = estimate_tokens(part)
+            if used + cost > budget:
+                break
+            parts.append(part)
+            used += cost
+        return "\n\n".join(parts) or None
+
+
+doc_index = DocumentIndex(RETRIEVAL_DIR, RETRIEVAL_EMBEDDER)
@@ -0,0 +1,360 @@
+"""Document text extraction in a process pool.
+
+Parsing a large PDF, DOCX or PPTX is CPU-bound; done inline it stalls the
+API's event loop (or a threadpool worker holding the GIL) for seconds.  This
+engine runs the parsers in worker processes, splits PDFs and decks into page
+ranges so that pages are yielded in order while later ranges are still being
+parsed, and bounds every job by a timeout and every document by a page limit.
+A job's timeout runs from when a worker starts it, not from when it was
+queued: the worker interrupts a job that overruns it, and only a job that
+cannot be interrupted (stuck in native code) costs the whole pool.
+PDF pages without a text layer and image files are OCRed in the same workers
+(see ``ocr``), so a scanned document is recognized on all of them at once.
+
+Both ``chat_api`` (through ``aiter_pages``) and the ``Chatbot`` CLI (through
+``iter_pages``/``extract_text``) use it.  This module must stay free of
+imports from ``core`` so worker processes start without the model client.
+"""
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import AsyncIterator, Iterator
+
+import ocr
+from metrics import extraction_seconds
+
+logger = logging.getLogger("extraction")
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "60"))
+MAX_PAGES = int(os.getenv("EXTRACT_MAX_PAGES", "500"))
+# Pages (or slides) parsed per pool job.
+PAGES_PER_JOB = 8
+# DOCX has no pages; paragraphs are grouped into pseudo-pages of this size.
+PARAGRAPHS_PER_PAGE = 40
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+# How often a waiting caller checks whether its job has overrun, and how far
+# past its timeout a job may run before its pool is reset.
+_POLL_SECONDS = 0.5
+_KILL_GRACE = 5.0
+# Size of the ring of job start times shared with the workers.
+_JOB_SLOTS = 1024
+
+
+class ExtractionError(Exception):
+    """Raised when a document cannot be parsed within its limits."""
+
+
+class _JobTimeout(Exception):
+    """Raised inside a worker when a job runs past its timeout."""
+
+
+# ---------------------------------------------------------
+# WORKER SIDE (runs in the pool processes)
+# ---------------------------------------------------------
+# Wall-clock start time of each running job by slot (0 until it starts);
+# shared memory set up by get_pool and handed to each worker by _init_worker.
+_started = None
+
+
+def _on_alarm(signum, frame):
+    raise _JobTimeout()
+
+
+def _init_worker(started) -> None:
+    global _started
+    _started = started
+    if hasattr(signal, "setitimer"):
+        signal.signal(signal.SIGALRM, _on_alarm)
+
+
+def _run(slot: int, timeout: float, fn, *args):
+    """Runs ``fn`` for a parent-side ``_Job``, recording its start and enforcing ``timeout``."""
+    _started[slot] = time.time()
+    if not hasattr(signal, "setitimer"):
+        return fn(*args)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _count_units(path: str) -> int:
+    """Number of independently extractable units (pages/slides) in the file."""
+    ext = Path(path).suffix.lower()
+    if ext == ".pdf":
+        import pypdf
+
+        return len(pypdf.PdfReader(path).pages)
+    if ext == ".pptx":
+        import pptx
+
+        return len(pptx.Presentation(path).slides)
+    return 1
+
+
+def _extract_units(path: str, start: int, stop: int) -> list[str]:
+    """Text of units ``start``..``stop`` of the file, one string per page."""
+    p = Path(path)
+    ext = p.suffix.lower()
+
+    if ext == ".pdf":
+        import pypdf
+
+        reader = pypdf.PdfReader(path)
+        pages = []
+        for i in range(start, stop):
+            page = reader.pages[i]
+            text = page.extract_text() or ""
+            if ocr.needs_ocr(text):
+                # Probably scanned: read the page image instead.
+                text = ocr.page_text(page) or text
+            pages.append(text)
+        return pages
+
+    if ext == ".pptx":
+        import pptx
+
+        slides = list(pptx.Presentation(path).slides)[start:stop]
+        return [
+            "\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text"))
+            for slide in slides
+        ]
+
+    if ext == ".docx":
+        import docx
+
+        paragraphs = [para.text for para in docx.Document(path).paragraphs]
+        return [
+            "\n".join(paragraphs[i:i + PARAGRAPHS_PER_PAGE])
+            for i in range(0, len(paragraphs), PARAGRAPHS_PER_PAGE)
+        ] or [""]
+
+    if ext in IMAGE_EXTENSIONS:
+        # Without readable text, leave a marker for the caller.
+        return [ocr.image_text(p.read_bytes()) or f"[Image file: {p.name}]"]
+
+    # Plain text
+    return [p.read_text(errors="ignore")]
+
+
+# ---------------------------------------------------------
+# POOL MANAGEMENT
+# ---------------------------------------------------------
+_pool: ProcessPoolExecutor | None = None
+
+
+_slots = itertools.count()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool, _started
+    if _pool is None:
+        # spawn rather than fork: the parent holds gRPC and event-loop threads.
+        context = multiprocessing.get_context("spawn")
+        if _started is None:
+            _started = context.RawArray("d", _JOB_SLOTS)
+        _pool = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(_started,),
+        )
+    return _pool
+
+
+def _reset_pool(pool: ProcessPoolExecutor | None = None) -> None:
+    """Discards the pool so a parser stuck past its timeout cannot hold a worker forever.
+
+    With ``pool`` given, does nothing unless that pool is still the current
+    one (another job may have reset it already).  Every other job on the
+    discarded pool fails with ``BrokenProcessPool``; see ``_Job.resubmit``.
+    """
+    global _pool
+    if pool is not None and pool is not _pool:
+        return
+    pool, _pool = _pool, None
+    if pool is None:
+        return
+    # ProcessPoolExecutor cannot cancel a running job; terminating the
+    # workers is the only way to reclaim them.
+    for proc in list(getattr(pool, "_processes", {}).values()):
+        proc.terminate()
+    pool.shutdown(wait=False)
+
+
+class _Job:
+    """A pool job that remembers its pool and arguments so it can be resubmitted."""
+
+    def __init__(self, timeout: float, fn, *args):
+        self.timeout = timeout
+        self.fn, self.args = fn, args
+        self.retried = False
+        self.submit()
+
+    def submit(self) -> None:
+        self.pool = get_pool()
+        self.slot = next(_slots) % _JOB_SLOTS
+        _started[self.slot] = 0.0
+        self.future = self.pool.submit(_run, self.slot, self.timeout, self.fn, *self.args)
+
+    def stuck(self) -> bool:
+        """Whether the job kept running well past its timeout, i.e. could not be interrupted."""
+        started = _started[self.slot]
+        return started > 0 and time.time() - started > self.timeout + _KILL_GRACE
+
+    def resubmit(self) -> bool:
+        """Resubmits, once, a job whose pool was reset because of another job.
+
+        A job that broke its own pool (its worker crashed) is not retried.
+        """
+        if self.retried or self.pool is _pool:
+            return False
+        self.retried = True
+        self.submit()
+        return True
+
+    def cancel(self) -> None:
+        self.future.cancel()
+
+
+def _preload() -> None:
+    import docx  # noqa: F401
+    import pptx  # noqa: F401
+    import pypdf  # noqa: F401
+    import pytesseract  # noqa: F401
+    from PIL import Image  # noqa: F401
+
+
+def warmup() -> None:
+    """Starts every pool worker and has it import the parsers ahead of the first upload."""
+    pool = get_pool()
+    try:
+        for job in [pool.submit(_preload) for _ in range(EXTRACT_WORKERS)]:
+            job.result(EXTRACT_TIMEOUT)
+    except (BrokenProcessPool, FutureTimeout) as exc:
+        # Not fatal: the pool is recreated on the first real job.
+        logger.warning("Extraction warmup failed: %s", exc)
+        _reset_pool()
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def _file_type(path: Path) -> str:
+    return path.suffix.lower().lstrip(".") or "none"
+
+
+def _ranges(units: int, max_pages: int) -> list[tuple[int, int]]:
+    units = min(units, max_pages)
+    return [(i, min(i + PAGES_PER_JOB, units)) for i in range(0, units, PAGES_PER_JOB)]
+
+
+# ---------------------------------------------------------
+# ASYNC API
+# ---------------------------------------------------------
+async def aiter_pages(
+    path: Path, max_pages: int = MAX_PAGES, timeout: float = EXTRACT_TIMEOUT
+) -> AsyncIterator[str]:
+    """Yields page texts in order while later page ranges parse in the pool."""
+
+    async def wait(job: _Job):
+        while True:
+            future = asyncio.wrap_future(job.future)
+            try:
+                while not future.done():
+                    await asyncio.wait((future,), timeout=_POLL_SECONDS)
+                    if not future.done() and job.stuck():
+                        _reset_pool(job.pool)
+                        raise ExtractionError(f"Timed out extracting {path.name}")
+                return future.result()
+            except asyncio.CancelledError:
+                job.cancel()
+                raise
+            except _JobTimeout:
+                raise ExtractionError(f"Timed out extracting {path.name}")
+            except BrokenProcessPool as exc:
+                if job.resubmit():
+                    continue
+                _reset_pool(job.pool)
+                raise ExtractionError(f"Extraction worker crashed on {path.name}") from exc
+
+    # Extraction time excludes the time the consumer spends between pages.
+    busy, started = 0.0, time.perf_counter()
+    ranges = deque(_ranges(await wait(_Job(timeout, _count_units, str(path))), max_pages))
+    pending: deque[_Job] = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < EXTRACT_WORKERS:
+                pending.append(_Job(timeout, _extract_units, str(path), *ranges.popleft()))
+            for page in await wait(pending.popleft()):
+                busy += time.perf_counter() - started
+                yield page
+                started = time.perf_counter()
+        extraction_seconds.observe(busy + time.perf_counter() - started, file_type=_file_type(path))
+    finally:
+        for job in pending:
+            job.cancel()
+
+
+# ---------------------------------------------------------
+# SYNC API
+# ---------------------------------------------------------
+def iter_pages(
+    path: Path, max_pages: int = MAX_PAGES, timeout: float = EXTRACT_TIMEOUT
+) -> Iterator[str]:
+    """Blocking twin of ``aiter_pages`` for callers without an event loop."""
+    path = Path(path)
+
+    def wait(job: _Job):
+        while True:
+            try:
+                return job.future.result(_POLL_SECONDS)
+            except FutureTimeout:
+                if job.stuck():
+                    _reset_pool(job.pool)
+                    raise ExtractionError(f"Timed out extracting {path.name}")
+            except _JobTimeout:
+                raise ExtractionError(f"Timed out extracting {path.name}")
+            except BrokenProcessPool as exc:
+                if job.resubmit():
+                    continue
+                _reset_pool(job.pool)
+                raise ExtractionError(f"Extraction worker crashed on {path.name}") from exc
+
+    busy, started = 0.0, time.perf_counter()
+    ranges = deque(_ranges(wait(_Job(timeout, _count_units, str(path))), max_pages))
+    pending: deque[_Job] = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < EXTRACT_WORKERS:
+                pending.append(_Job(timeout, _extract_units, str(path), *ranges.popleft()))
+            for page in wait(pending.popleft()):
+                busy += time.perf_counter() - started
+                yield page
+                started = time.perf_counter()
+        extraction_seconds.observe(busy + time.perf_counter() - started, file_type=_file_type(path))
+    finally:
+        for job in pending:
+            job.cancel()
+
+
+def extract_text(path: Path, max_pages: int = MAX_PAGES) -> str:
+    return "\n".join(iter_pages(path, max_pages))
@@ -0,0 +1,116 @@
+"""Local stand-in for the Gemini models, selected with ``LLM_BACKEND=fake``.
+
+``FakeModel`` mimics the parts of ``genai.GenerativeModel`` this app uses
+(``generate_content``, ``generate_content_async`` and streaming) with a
+configurable latency and injected failures, so the API can be run, load
+tested and benchmarked without an API key or quota:
+
+- ``FAKE_LLM_LATENCY``: mean seconds per call (default 0.2),
+- ``FAKE_LLM_JITTER``: +/- fraction of the latency (default 0.25),
+- ``FAKE_LLM_ERROR_RATE``: fraction of calls failing with a server error,
+- ``FAKE_LLM_429_RATE``: fraction of calls failing with a 429,
+- ``FAKE_LLM_REPLY_WORDS``: words per reply (default 80),
+- ``FAKE_LLM_STREAM_CHUNKS``: chunks per streamed reply (default 8).
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import time
+
+LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.2"))
+JITTER = float(os.getenv("FAKE_LLM_JITTER", "0.25"))
+ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+RATE_LIMIT_RATE = float(os.getenv("FAKE_LLM_429_RATE", "0"))
+REPLY_WORDS = int(os.getenv("FAKE_LLM_REPLY_WORDS", "80"))
+STREAM_CHUNKS = int(os.getenv("FAKE_LLM_STREAM_CHUNKS", "8"))
+
+_WORDS = (
+    "learning focus calm step idea example practice memory review question "
+    "answer concept detail summary picture pattern reason simple clear next"
+).split()
+
+
+class FakeError(Exception):
+    """A failure injected by the fake backend."""
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, reply_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = reply_tokens
+
+
+class FakeResponse:
+    def __init__(self, text: str, usage: _Usage | None = None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class _FakeStream:
+    def __init__(self, chunks: list[str], usage: _Usage, delay: float):
+        self._chunks = chunks
+        self._usage = usage
+        self._delay = delay
+
+    async def __aiter__(self):
+        for i, text in enumerate(self._chunks):
+            await asyncio.sleep(self._delay)
+            last = i == len(self._chunks) - 1
+            yield FakeResponse(text, self._usage if last else None)
+
+
+def _prompt_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    return " ".join(part for part in contents if isinstance(part, str))
+
+
+class FakeModel:
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def _latency(self) -> float:
+        return max(0.0, LATENCY * (1 + random.uniform(-JITTER, JITTER)))
+
+    def _maybe_fail(self) -> None:
+        roll = random.random()
+        if roll < RATE_LIMIT_RATE:
+            raise FakeError("429 Resource has been exhausted (fake backend)")
+        if roll < RATE_LIMIT_RATE + ERROR_RATE:
+            raise FakeError("500 Internal error (fake backend)")
+
+    def _reply(self, contents, cfg: dict | None) -> tuple[str, _Usage]:
+        prompt = _prompt_text(contents)
+        # Deterministic per prompt so cached and uncached replies agree.
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        limit = (cfg or {}).get("max_output_tokens") or REPLY_WORDS
+        words = [rng.choice(_WORDS) for _ in range(min(REPLY_WORDS, int(limit)))]
+        text = " ".join(words).capitalize() + "."
+        return text, _Usage(len(prompt) // 4, len(words))
+
+    def generate_content(self, contents, generation_config=None, **kwargs) -> FakeResponse:
+        time.sleep(self._latency())
+        self._maybe_fail()
+        return FakeResponse(*self._reply(contents, generation_config))
+
+    async def generate_content_async(
+        self, contents, generation_config=None, stream: bool = False, **kwargs
+    ):
+        latency = self._latency()
+        text, usage = self._reply(contents, generation_config)
+        if not stream:
+            await asyncio.sleep(latency)
+            self._maybe_fail()
+            return FakeResponse(text, usage)
+        # Time to first chunk is a quarter of the call, the rest is spread out.
+        await asyncio.sleep(latency / 4)
+        self._maybe_fail()
+        words = text.split(" ")
+        size = max(1, -(-len(words) // STREAM_CHUNKS))
+        chunks = [
+            " ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+            for i in range(0, len(words), size)
+        ]
+        return _FakeStream(chunks, usage, 3 * latency / 4 / len(chunks))
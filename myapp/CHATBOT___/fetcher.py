@@ -0,0 +1,211 @@
+"""Pooled HTTP fetching with a size cap and an on-disk HTTP cache.
+
+All URL fetches share one ``requests.Session`` so repeat requests to a host
+reuse pooled keep-alive connections instead of paying a new TCP/TLS handshake;
+``requests`` itself is only imported by the first fetch.
+Bodies are streamed and abandoned as soon as they exceed the size limit.
+Responses are stored on disk with their validators; while fresh
+(``Cache-Control: max-age``/``Expires``) they are served without touching the
+network, and afterwards they are revalidated with ``If-None-Match`` /
+``If-Modified-Since`` so an unchanged page costs a 304.  The cache directory
+is kept within ``HTTP_CACHE_MAX_BYTES`` and ``HTTP_CACHE_MAX_AGE`` by a
+``cache_sweep.CacheSweeper``.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import deadline
+from cache_sweep import CacheSweeper
+
+if TYPE_CHECKING:  # imported by the first fetch, see get_session()
+    import requests
+
+HTTP_CACHE_DIR = Path(os.getenv("HTTP_CACHE_DIR", "http_cache"))
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(256 << 20)))
+HTTP_CACHE_MAX_AGE = float(os.getenv("HTTP_CACHE_MAX_AGE", str(7 * 86400)))
+MAX_FETCH_BYTES = int(os.getenv("MAX_FETCH_BYTES", str(5 << 20)))
+FETCH_TIMEOUT = 10.0
+_CHUNK = 64 << 10
+
+
+class FetchError(Exception):
+    """Raised when a URL cannot be fetched within the configured limits."""
+
+
+@dataclass
+class FetchResult:
+    url: str
+    body: bytes
+    content_type: str
+    digest: str  # sha256 of the body, stable across revalidations
+    from_cache: bool = False
+
+
+_session: "requests.Session | None" = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> "requests.Session":
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = "NeuroAdaptive-Companion/1.0"
+                _session = session
+    return _session
+
+
+# ---------------------------------------------------------
+# CACHE ENTRIES
+# ---------------------------------------------------------
+def _entry_paths(url: str) -> tuple[Path, Path]:
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    base = HTTP_CACHE_DIR / key[:2] / key
+    return base.with_suffix(".json"), base.with_suffix(".body")
+
+
+def _load(url: str) -> dict | None:
+    meta_path, body_path = _entry_paths(url)
+    try:
+        meta = json.loads(meta_path.read_text())
+        meta["body"] = body_path.read_bytes()
+    except (OSError, ValueError):
+        return None
+    return meta
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+_sweeper = CacheSweeper("http_cache", HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES, HTTP_CACHE_MAX_AGE)
+
+
+def _store(url: str, meta: dict, body: bytes | None = None) -> None:
+    meta_path, body_path = _entry_paths(url)
+    if body is not None:
+        _write_atomic(body_path, body)
+    else:
+        # Revalidated: the body is still current, so it ages with its metadata.
+        try:
+            os.utime(body_path)
+        except OSError:
+            pass
+    meta = {k: v for k, v in meta.items() if k != "body"}
+    _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+    _sweeper.written()
+
+
+def _freshness(headers) -> tuple[bool, float]:
+    """Returns (storable, expires_at) from the response caching headers."""
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control:
+        return False, 0.0
+    if "no-cache" in cache_control:
+        return True, 0.0
+    match = re.search(r"(?:s-maxage|max-age)=(\d+)", cache_control)
+    if match:
+        return True, time.time() + int(match.group(1))
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return True, parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return True, 0.0
+    return True, 0.0
+
+
+def _result(url: str, meta: dict, from_cache: bool) -> FetchResult:
+    return FetchResult(
+        url=url,
+        body=meta["body"],
+        content_type=meta.get("content_type", ""),
+        digest=meta["digest"],
+        from_cache=from_cache,
+    )
+
+
+# ---------------------------------------------------------
+# FETCH
+# ---------------------------------------------------------
+def fetch(url: str, timeout: float | None = None, max_bytes: int = MAX_FETCH_BYTES) -> FetchResult:
+    """Fetches ``url`` through the HTTP cache.
+
+    ``timeout`` defaults to ``FETCH_TIMEOUT`` shortened to the request deadline.
+    Raises ``FetchError`` for network/HTTP errors, when the body exceeds
+    ``max_bytes`` or when the deadline passes.
+    """
+    import requests
+
+    if timeout is None:
+        timeout = deadline.timeout(FETCH_TIMEOUT)
+    try:
+        return _fetch(url, timeout, max_bytes)
+    except requests.RequestException as exc:
+        raise FetchError(str(exc)) from exc
+
+
+def _fetch(url: str, timeout: float, max_bytes: int) -> FetchResult:
+    cached = _load(url)
+    if cached and cached.get("expires", 0) > time.time():
+        return _result(url, cached, from_cache=True)
+
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    with get_session().get(url, timeout=timeout, stream=True, headers=headers) as response:
+        if response.status_code == 304 and cached:
+            storable, cached["expires"] = _freshness(response.headers)
+            cached["etag"] = response.headers.get("ETag", cached.get("etag"))
+            if storable:
+                _store(url, cached)
+            return _result(url, cached, from_cache=True)
+
+        response.raise_for_status()
+        declared = response.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise FetchError(f"Response from {url} exceeds {max_bytes} bytes")
+        body = bytearray()
+        for chunk in response.iter_content(_CHUNK):
+            body += chunk
+            if len(body) > max_bytes:
+                raise FetchError(f"Response from {url} exceeds {max_bytes} bytes")
+            if deadline.expired():
+                raise FetchError(f"Request deadline passed while fetching {url}")
+        body = bytes(body)
+
+        storable, expires = _freshness(response.headers)
+        meta = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type", ""),
+            "expires": expires,
+            "digest": hashlib.sha256(body).hexdigest(),
+            "body": body,
+        }
+    if storable and (meta["etag"] or meta["last_modified"] or expires > time.time()):
+        _store(url, meta, body)
+    return _result(url, meta, from_cache=False)
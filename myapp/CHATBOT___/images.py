@@ -0,0 +1,177 @@
+"""Snapshot preprocessing and near-duplicate caching.
+
+``prepare`` decodes a snapshot with Pillow whatever the client claimed it
+was, applies the EXIF orientation, downscales it to ``SNAPSHOT_MAX_SIDE`` and
+re-encodes it as JPEG, keeping the original bytes when those are already
+smaller.  It also computes a 256-bit difference hash (dHash) so the same
+slide snapped again, e.g. re-compressed by the client, is answered from
+``snapshot_cache`` instead of the model.  Text-heavy slides that differ in a
+few words hash only a few bits apart, so the match distance is kept small.
+``prepare`` is CPU bound: call it from a worker thread.
+"""
+
+import asyncio
+import io
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from metrics import extraction_seconds
+
+SNAPSHOT_MAX_SIDE = int(os.getenv("SNAPSHOT_MAX_SIDE", "1568"))
+SNAPSHOT_JPEG_QUALITY = int(os.getenv("SNAPSHOT_JPEG_QUALITY", "85"))
+HASH_SIZE = 16  # hash is HASH_SIZE**2 bits
+# Differing bits (of 256) at which two snapshots still count as the same.
+SNAPSHOT_HASH_DISTANCE = int(os.getenv("SNAPSHOT_HASH_DISTANCE", "4"))
+SNAPSHOT_CACHE_TTL = float(os.getenv("SNAPSHOT_CACHE_TTL", "3600"))
+# Refuse images that would decode to more pixels than this (decompression bombs).
+MAX_PIXELS = 40_000_000
+
+INPUT_FORMATS = {"JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF"}
+# Formats the model accepts as is.
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+class InvalidImage(ValueError):
+    """The bytes are not an image in a supported format."""
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    dhash: int
+    size: tuple[int, int]
+
+
+def dhash(image, size: int = HASH_SIZE) -> int:
+    """Difference hash: horizontal brightness gradients of a tiny grayscale copy."""
+    from PIL import Image
+
+    width = size + 1
+    pixels = image.convert("L").resize((width, size), Image.Resampling.BOX).tobytes()
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * width + col]
+            bits = (bits << 1) | (left > pixels[row * width + col + 1])
+    return bits
+
+
+def _flatten(image):
+    """RGB on a white background, so transparent screenshots stay readable."""
+    from PIL import Image
+
+    if image.mode in ("RGB", "L"):
+        return image
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def prepare(data: bytes, max_side: int = SNAPSHOT_MAX_SIDE) -> PreparedImage:
+    """Decodes, orients, downscales and re-encodes a snapshot."""
+    from PIL import Image, ImageOps
+
+    started = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            fmt = source.format
+            if fmt not in INPUT_FORMATS:
+                raise InvalidImage(f"Unsupported image format: {fmt or 'unknown'}")
+            width, height = source.size
+            if width * height > MAX_PIXELS:
+                raise InvalidImage("Image is too large")
+            # JPEG only: decode at the smallest scale still above the target.
+            source.draft("RGB", (max_side, max_side))
+            image = _flatten(ImageOps.exif_transpose(source))
+            resized = max(image.size) > max_side
+            if resized:
+                image.thumbnail((max_side, max_side), Image.Resampling.BICUBIC, reducing_gap=2.0)
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=SNAPSHOT_JPEG_QUALITY, optimize=True)
+            prepared = PreparedImage(out.getvalue(), "image/jpeg", dhash(image), image.size)
+    except (OSError, SyntaxError, Image.DecompressionBombError) as exc:
+        raise InvalidImage("Could not decode the image") from exc
+    finally:
+        extraction_seconds.observe(time.perf_counter() - started, file_type="image")
+
+    if not resized and fmt in MIME_TYPES and len(data) <= len(prepared.data):
+        prepared.data, prepared.mime_type = data, MIME_TYPES[fmt]
+    return prepared
+
+
+class SnapshotCache:
+    """Recent snapshot analyses, looked up by dHash distance.
+
+    Concurrent requests for near-identical snapshots share one model call.
+    Failures are not cached.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        max_distance: int = SNAPSHOT_HASH_DISTANCE,
+        ttl: float = SNAPSHOT_CACHE_TTL,
+    ):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, str]] = OrderedDict()
+        self._inflight: dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _near(self, keys, image_hash: int) -> int | None:
+        for key in keys:
+            if (key ^ image_hash).bit_count() <= self.max_distance:
+                return key
+        return None
+
+    def get(self, image_hash: int) -> str | None:
+        key = self._near(self._entries, image_hash)
+        if key is not None:
+            created, summary = self._entries[key]
+            if time.monotonic() - created <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return summary
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, image_hash: int, summary: str) -> None:
+        self._entries[image_hash] = (time.monotonic(), summary)
+        self._entries.move_to_end(image_hash)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(
+        self, image_hash: int, compute: Callable[[], Awaitable[str]]
+    ) -> str:
+        cached = self.get(image_hash)
+        if cached is not None:
+            return cached
+        key = self._near(self._inflight, image_hash)
+        if key is not None:
+            return await asyncio.shield(self._inflight[key])
+
+        task = asyncio.ensure_future(self._compute_and_store(image_hash, compute))
+        self._inflight[image_hash] = task
+        task.add_done_callback(lambda _: self._inflight.pop(image_hash, None))
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(
+        self, image_hash: int, compute: Callable[[], Awaitable[str]]
+    ) -> str:
+        summary = await compute()
+        self.put(image_hash, summary)
+        return summary
+
+
+snapshot_cache = SnapshotCache()
@@ -0,0 +1,171 @@
+"""XP leaderboard backed by an order-statistic skip list.
+
+The index is built once from the user store at startup and then updated in
+place whenever a user's ``totalXP`` changes, so top-k, rank and
+neighbourhood queries are O(log n + k) and never sort the user set.
+
+The index lives in the process that serves ``avatar_api``; with several
+worker processes each keeps its own copy, which only reflects the XP changes
+that process applied since it started.
+"""
+
+import random
+import threading
+from typing import Iterable
+
+_MAX_LEVEL = 24  # enough for 4**24 entries at p = 1/4
+_P = 0.25
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: list["_Node | None"] = [None] * level
+        # width[i]: how many level-0 steps next[i] is ahead of this node.
+        self.width = [1] * level
+
+
+class RankIndex:
+    """Sorted set of keys with O(log n) insert, remove, rank and positional access."""
+
+    def __init__(self):
+        self._head = _Node(None, _MAX_LEVEL)
+        self._level = 1
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < _MAX_LEVEL and random.random() < _P:
+            level += 1
+        return level
+
+    def insert(self, key) -> None:
+        update = [self._head] * _MAX_LEVEL
+        rank = [0] * _MAX_LEVEL
+        node, pos = self._head, 0
+        for i in reversed(range(_MAX_LEVEL)):
+            while node.next[i] is not None and node.next[i].key < key:
+                pos += node.width[i]
+                node = node.next[i]
+            update[i], rank[i] = node, pos
+
+        level = self._random_level()
+        self._level = max(self._level, level)
+        new = _Node(key, level)
+        for i in range(level):
+            prev = update[i]
+            new.next[i] = prev.next[i]
+            prev.next[i] = new
+            new.width[i] = prev.width[i] - (pos - rank[i])
+            prev.width[i] = pos - rank[i] + 1
+        for i in range(level, _MAX_LEVEL):
+            update[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key) -> None:
+        update = [self._head] * _MAX_LEVEL
+        node = self._head
+        for i in reversed(range(_MAX_LEVEL)):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for i in range(_MAX_LEVEL):
+            prev = update[i]
+            if prev.next[i] is target:
+                prev.width[i] += target.width[i] - 1
+                prev.next[i] = target.next[i]
+            else:
+                prev.width[i] -= 1
+        self.size -= 1
+
+    def rank(self, key) -> int:
+        """Zero-based position of ``key``; raises KeyError if absent."""
+        node, pos = self._head, 0
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                pos += node.width[i]
+                node = node.next[i]
+        found = node.next[0]
+        if found is None or found.key != key:
+            raise KeyError(key)
+        return pos
+
+    def slice(self, start: int, stop: int) -> list:
+        """Keys at zero-based positions ``start`` up to (excluding) ``stop``."""
+        start, stop = max(start, 0), min(stop, self.size)
+        if start >= stop:
+            return []
+        node, pos = self._head, 0
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and pos + node.width[i] <= start + 1:
+                pos += node.width[i]
+                node = node.next[i]
+        keys = []
+        while node is not None and len(keys) < stop - start:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    """Users ordered by ``totalXP`` (descending), ties broken by user id."""
+
+    def __init__(self, entries: Iterable[tuple[str, int]] = ()):
+        self._index = RankIndex()
+        self._xp: dict[str, int] = {}
+        self._lock = threading.Lock()
+        for user_id, total_xp in entries:
+            self.update(user_id, total_xp)
+
+    def update(self, user_id: str, total_xp: int) -> None:
+        """Records a user's new ``totalXP``; values below the stored one are ignored.
+
+        XP only ever goes up, and callers update after their write has
+        committed, so two concurrent requests may report their totals out of
+        order: keeping the maximum makes the final state independent of that.
+        """
+        total_xp = int(total_xp)
+        with self._lock:
+            old = self._xp.get(user_id)
+            if old is not None and total_xp <= old:
+                return
+            if old is not None:
+                self._index.remove((-old, user_id))
+            self._index.insert((-total_xp, user_id))
+            self._xp[user_id] = total_xp
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _entries(self, start: int, stop: int) -> list[dict]:
+        start = max(start, 0)
+        return [
+            {"rank": start + i + 1, "userId": user_id, "totalXP": -neg_xp}
+            for i, (neg_xp, user_id) in enumerate(self._index.slice(start, stop))
+        ]
+
+    def top(self, k: int) -> list[dict]:
+        with self._lock:
+            return self._entries(0, k)
+
+    def standing(self, user_id: str, radius: int = 0) -> dict | None:
+        """The user's 1-based rank plus up to ``radius`` neighbours on each side."""
+        with self._lock:
+            total_xp = self._xp.get(user_id)
+            if total_xp is None:
+                return None
+            pos = self._index.rank((-total_xp, user_id))
+            return {
+                "rank": pos + 1,
+                "userId": user_id,
+                "totalXP": total_xp,
+                "neighbors": self._entries(pos - radius, pos + radius + 1),
+            }
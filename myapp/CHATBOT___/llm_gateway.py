@@ -0,0 +1,300 @@
+"""Async gateway to the Gemini models used by the HTTP API.
+
+``core.call_model`` blocks the calling thread for the whole generation, which
+ties up a threadpool worker per in-flight chat.  The gateway awaits the
+native async client instead and reuses one client per model.  Every model
+call is admitted by the ``scheduler``, which caps concurrency and orders
+waiting calls by priority and per-user fairness, and its outcome is recorded
+by the ``router``, which skips models whose circuit is open and hedges slow
+primary calls with the fallback model.  Calls stop as soon as the current
+request's ``deadline`` has passed.
+"""
+
+import asyncio
+import logging
+import time
+from typing import AsyncIterator
+
+import deadline
+import metrics
+from core import (
+    FALLBACK_MODEL,
+    GEN_CFG,
+    GREETING_REPLY,
+    PRIMARY_MODEL,
+    SHORT_CFG,
+    SUMMARY_CFG,
+    StreamCleaner,
+    build_adaptive_prompt,
+    clean,
+    get_model,
+    is_greeting,
+    record_call,
+    record_usage,
+    short_prompt,
+    summary_prompt,
+    wants_analogy,
+)
+from response_cache import adaptive_cache, adaptive_cache_key, is_cacheable_reply
+from router import hedged, router
+from scheduler import Overloaded, scheduler
+
+logger = logging.getLogger("llm_gateway")
+
+
+def _record(model: str, mode: str, elapsed: float, exc: Exception | None = None) -> None:
+    """Feeds one finished call to the router and the metrics."""
+    # Stream durations are not comparable with single calls, so only their
+    # outcome feeds the circuit breaker.
+    router.record(model, elapsed if mode == "call" else None, ok=exc is None)
+    record_call(model, mode, elapsed, exc)
+
+
+def _fallback(reason: str) -> None:
+    metrics.llm_fallbacks.inc(reason=reason)
+
+
+async def _generate(model: str, contents, cfg: dict | None = None) -> str:
+    deadline.check()
+    async with scheduler.slot():
+        deadline.check()
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                get_model(model).generate_content_async(contents, generation_config=cfg),
+                deadline.remaining(),
+            )
+        except asyncio.TimeoutError:
+            metrics.llm_errors.inc(model=model, kind="deadline")
+            raise deadline.DeadlineExceeded(f"Request deadline exceeded waiting for {model}")
+        except asyncio.CancelledError:
+            elapsed = time.monotonic() - start
+            router.record_cancelled(model, elapsed)
+            metrics.llm_request_seconds.observe(
+                elapsed, model=model, mode="call", outcome="cancelled"
+            )
+            raise
+        except Exception as exc:
+            _record(model, "call", time.monotonic() - start, exc)
+            raise
+        _record(model, "call", time.monotonic() - start)
+        record_usage(model, result)
+    return clean(getattr(result, "text", "") or "")
+
+
+async def call_model_async(
+    prompt: str, model: str = PRIMARY_MODEL, cfg: dict | None = None
+) -> str:
+    """Async twin of ``core.call_model`` with the same fallback chain.
+
+    Models whose circuit is open are skipped, and a primary call that runs
+    past its recent p95 latency is hedged with the fallback model.
+    """
+    cfg = cfg or GEN_CFG
+    last_error = None
+    hedge_sent = False
+
+    def on_hedge():
+        nonlocal hedge_sent
+        hedge_sent = True
+        router.spend_hedge()
+        _fallback("hedge")
+
+    if router.allow(model):
+        delay = router.hedge_delay(model, FALLBACK_MODEL)
+        try:
+            if delay is None:
+                reply = await _generate(model, prompt, cfg)
+            else:
+                reply = await hedged(
+                    lambda: _generate(model, prompt, cfg),
+                    lambda: _generate(FALLBACK_MODEL, prompt, cfg),
+                    delay,
+                    on_hedge,
+                )
+            logger.debug("Model: %s, Reply length: %s", model, len(reply))
+            if reply:
+                return reply
+        except (Overloaded, deadline.DeadlineExceeded):
+            raise
+        except Exception as exc:  # pragma: no cover - external service
+            last_error = exc
+            if "429" in str(exc):
+                await deadline.sleep(1.2)
+    else:
+        last_error = f"circuit open for {model}"
+        _fallback("circuit_open")
+
+    if last_error and not hedge_sent and router.allow(FALLBACK_MODEL):
+        _fallback("fallback")
+        try:
+            reply = await _generate(FALLBACK_MODEL, prompt, cfg)
+            if reply:
+                return reply
+        except (Overloaded, deadline.DeadlineExceeded):
+            raise
+        except Exception as exc:  # pragma: no cover
+            last_error = exc
+
+    if last_error and router.allow(FALLBACK_MODEL):
+        _fallback("short_prompt")
+        try:
+            reply = await _generate(FALLBACK_MODEL, short_prompt(prompt), SHORT_CFG)
+            if reply:
+                return reply
+        except (Overloaded, deadline.DeadlineExceeded):
+            raise
+        except Exception as exc:  # pragma: no cover
+            last_error = exc
+
+    return f"Model unavailable: {last_error or 'unknown error'}"
+
+
+async def _stream(model: str, prompt: str, cfg: dict) -> AsyncIterator[str]:
+    async with scheduler.slot():
+        start = time.monotonic()
+        chunk = None
+        try:
+            response = await get_model(model).generate_content_async(
+                prompt, generation_config=cfg, stream=True
+            )
+            cleaner = StreamCleaner()
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:  # chunk without text parts, e.g. a safety block
+                    continue
+                text = cleaner.feed(text)
+                if text:
+                    yield text
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception as exc:
+            _record(model, "stream", time.monotonic() - start, exc)
+            raise
+        _record(model, "stream", time.monotonic() - start)
+        # The last chunk carries the usage totals for the whole stream.
+        record_usage(model, chunk)
+
+
+async def stream_model(
+    prompt: str, model: str = PRIMARY_MODEL, cfg: dict | None = None
+) -> AsyncIterator[tuple[str, str]]:
+    """Streams a completion as ``(event, text)`` pairs using the ``call_model`` fallback chain.
+
+    Events are ``"delta"`` for cleaned text, ``"reset"`` when an attempt failed
+    after it had already produced text (the consumer must discard what it has
+    received so far) and ``"error"`` once every attempt has failed.
+    """
+    cfg = cfg or GEN_CFG
+    attempts = [
+        (model, prompt, cfg, None),
+        (FALLBACK_MODEL, prompt, cfg, "fallback"),
+        (FALLBACK_MODEL, short_prompt(prompt), SHORT_CFG, "short_prompt"),
+    ]
+    last_error = None
+    for name, text, attempt_cfg, reason in attempts:
+        deadline.check()
+        if not router.allow(name):
+            last_error = last_error or f"circuit open for {name}"
+            _fallback("circuit_open")
+            continue
+        if reason:
+            _fallback(reason)
+        emitted = False
+        try:
+            async for delta in _stream(name, text, attempt_cfg):
+                emitted = True
+                yield "delta", delta
+        except (Overloaded, deadline.DeadlineExceeded):
+            raise
+        except Exception as exc:  # pragma: no cover - external service
+            last_error = exc
+            logger.warning("Streaming from %s failed: %s", name, exc)
+            if emitted:
+                yield "reset", ""
+            elif "429" in str(exc):
+                await deadline.sleep(1.2)
+            continue
+        if emitted:
+            return
+    yield "error", f"Model unavailable: {last_error or 'unknown error'}"
+
+
+async def adaptive_async(
+    profile: str,
+    state: str,
+    user_input: str,
+    history: str | None = None,
+    context: str | None = None,
+) -> str:
+    if is_greeting(user_input):
+        return GREETING_REPLY
+    ask_analogy = wants_analogy(state, user_input)
+    key = (
+        None if ask_analogy
+        else adaptive_cache_key(profile, state, user_input, history, context)
+    )
+    if key:
+        cached = adaptive_cache.get(key)
+        if cached is not None:
+            return cached
+    reply = await call_model_async(
+        build_adaptive_prompt(profile, state, user_input, history, ask_analogy, context)
+    )
+    if key and is_cacheable_reply(reply):
+        adaptive_cache.put(key, reply)
+    return reply
+
+
+async def stream_adaptive(
+    profile: str,
+    state: str,
+    user_input: str,
+    history: str | None = None,
+    context: str | None = None,
+) -> AsyncIterator[tuple[str, str]]:
+    """Streaming variant of ``adaptive_async``; yields ``stream_model`` events."""
+    if is_greeting(user_input):
+        yield "delta", GREETING_REPLY
+        return
+    ask_analogy = wants_analogy(state, user_input)
+    key = (
+        None if ask_analogy
+        else adaptive_cache_key(profile, state, user_input, history, context)
+    )
+    if key:
+        cached = adaptive_cache.get(key)
+        if cached is not None:
+            yield "delta", cached
+            return
+    parts: list[str] = []
+    prompt = build_adaptive_prompt(profile, state, user_input, history, ask_analogy, context)
+    async for event, text in stream_model(prompt):
+        if event == "delta":
+            parts.append(text)
+        elif event == "reset":
+            parts.clear()
+        yield event, text
+    reply = "".join(parts)
+    if key and is_cacheable_reply(reply):
+        adaptive_cache.put(key, reply)
+
+
+async def summarize_text_async(text: str, context: str = "") -> str:
+    """Generates a summary for a given text using the LLM."""
+    return await call_model_async(summary_prompt(text, context), cfg=SUMMARY_CFG)
+
+
+async def analyze_image_async(
+    image_data: bytes, prompt: str, mime_type: str = "image/jpeg"
+) -> str:
+    """Analyzes an image using the multimodal model."""
+    try:
+        image_parts = [{"mime_type": mime_type, "data": image_data}]
+        return await _generate(PRIMARY_MODEL, [prompt, *image_parts])
+    except (Overloaded, deadline.DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.warning("Image analysis error: %s", e)
+        return "Error: Could not analyze the image."
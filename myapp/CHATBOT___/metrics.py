@@ -0,0 +1,188 @@
+"""Minimal in-process metrics rendered in the Prometheus text format.
+
+Counters and histograms are plain dicts keyed by label values behind one
+lock, so recording a sample costs a dict lookup and a few additions and the
+instrumentation can stay on in production.  Values that already live
+elsewhere (cache hit counters, queue depths) are read at scrape time through
+collectors registered with ``register_collector``.
+
+Each process keeps its own registry; ``/metrics`` on ``chat_api`` and
+``avatar_api`` report their own process only.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_metrics: list["_Metric"] = []
+_collectors: list[Callable[[], Iterable[tuple[str, str, dict, float]]]] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: dict[tuple, object] = {}
+        with _lock:
+            _metrics.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {value:g}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            cumulative += counts[-1]
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, inf)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total:g}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+def register_collector(collect: Callable[[], Iterable[tuple[str, str, dict, float]]]) -> None:
+    """Adds a scrape-time source of ``(name, type, labels, value)`` samples."""
+    with _lock:
+        _collectors.append(collect)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        lines = [line for metric in _metrics for line in metric.render()]
+        collectors = list(_collectors)
+    seen = set()
+    for collect in collectors:
+        for name, kind, labels, value in collect():
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+            names = tuple(labels)
+            lines.append(f"{name}{_labels(names, tuple(labels.values()))} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+class ASGIMetricsMiddleware:
+    """Records request latency by method, route template and status for an ASGI app.
+
+    Requests that matched no route are reported as ``unmatched`` so scanners
+    cannot blow up label cardinality.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 499  # no response sent: the client went away first
+
+        async def record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, record_status)
+        finally:
+            # FastAPI's router leaves the matched route in the scope.
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_request_seconds.observe(
+                time.perf_counter() - start, method=scope["method"], route=route, status=status
+            )
+
+
+# ---------------------------------------------------------
+# SHARED METRICS
+# ---------------------------------------------------------
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+)
+llm_request_seconds = Histogram(
+    "llm_request_duration_seconds", "Model call latency", ("model", "mode", "outcome")
+)
+llm_errors = Counter("llm_errors_total", "Failed model calls", ("model", "kind"))
+llm_fallbacks = Counter(
+    "llm_fallbacks_total", "Calls moved off the requested model", ("reason",)
+)
+llm_tokens = Counter("llm_tokens_total", "Tokens reported by the model API", ("model", "kind"))
+extraction_seconds = Histogram(
+    "extraction_duration_seconds", "Document text extraction time", ("file_type",)
+)
+store_seconds = Histogram(
+    "store_operation_duration_seconds",
+    "Storage operation latency",
+    ("store", "op"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
@@ -0,0 +1,126 @@
+"""OCR for images and scanned PDF pages, run inside the extraction pool.
+
+``extraction`` calls ``page_text`` for every PDF page whose text layer is
+(nearly) empty and ``image_text`` for uploaded images.  A scanned page is
+usually one full-page image, so the page's embedded images are read straight
+from the PDF (no renderer needed) and passed to Tesseract.  Because pages are
+spread over the extraction pool's worker processes, a scanned document is
+OCRed on every worker at once.
+
+Results are cached on disk, one file per image keyed by the SHA-256 of its
+bytes and the OCR language, so the pool workers share the cache and a
+re-uploaded handout is not OCRed again; the cache is kept within
+``OCR_CACHE_MAX_BYTES`` and ``OCR_CACHE_MAX_AGE`` by a
+``cache_sweep.CacheSweeper``.  Like ``extraction``, this module must not
+import ``core``.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+from pathlib import Path
+
+from cache_sweep import CacheSweeper
+
+logger = logging.getLogger("ocr")
+
+OCR_ENABLED = os.getenv("OCR_ENABLED", "1") != "0"
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_CACHE_DIR = Path(os.getenv("OCR_CACHE_DIR", "ocr_cache"))
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(64 << 20)))
+OCR_CACHE_MAX_AGE = float(os.getenv("OCR_CACHE_MAX_AGE", str(30 * 86400)))
+# A PDF page whose text layer has fewer characters than this is OCRed.
+OCR_MIN_CHARS = 16
+# Scans are downscaled to at most this many pixels on the long side first.
+OCR_MAX_SIDE = 4000
+# Embedded images smaller than this (logos, bullets) are skipped.
+OCR_MIN_SIDE = 64
+
+# Each worker runs one Tesseract at a time; its own threading would only
+# compete with the other workers.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+_missing = False
+# Each pool worker sweeps on its own schedule; the directory is shared.
+_sweeper = CacheSweeper("ocr_cache", OCR_CACHE_DIR, OCR_CACHE_MAX_BYTES, OCR_CACHE_MAX_AGE)
+
+
+def _cache_path(data: bytes) -> Path:
+    digest = hashlib.sha256(OCR_LANG.encode() + b"\0" + data).hexdigest()
+    return OCR_CACHE_DIR / digest[:2] / f"{digest}.txt"
+
+
+def _cached(path: Path) -> str | None:
+    try:
+        return path.read_text(encoding="utf-8")
+    except OSError:
+        return None
+
+
+def _store(path: Path, text: str) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError as exc:
+        logger.warning("Could not cache OCR result: %s", exc)
+        return
+    _sweeper.written()
+
+
+def _recognize(data: bytes) -> str | None:
+    """Tesseract's text for an encoded image; None if the image is not worth reading."""
+    global _missing
+    import pytesseract
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        if min(image.size) < OCR_MIN_SIDE:
+            return None
+        gray = ImageOps.exif_transpose(image).convert("L")
+    gray.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE))
+    try:
+        return pytesseract.image_to_string(gray, lang=OCR_LANG)
+    except pytesseract.TesseractNotFoundError:
+        _missing = True
+        logger.warning("Tesseract is not installed; OCR is disabled")
+        return None
+
+
+def image_text(data: bytes) -> str:
+    """OCR text of an encoded image, from the cache when seen before."""
+    if not OCR_ENABLED or _missing:
+        return ""
+    path = _cache_path(data)
+    cached = _cached(path)
+    if cached is not None:
+        return cached
+    try:
+        text = _recognize(data)
+    except Exception as exc:  # undecodable image, Tesseract failure
+        logger.warning("OCR failed: %s", exc)
+        return ""
+    if text is None:
+        return ""
+    text = text.strip()
+    _store(path, text)
+    return text
+
+
+def needs_ocr(text: str) -> bool:
+    return OCR_ENABLED and len(text.strip()) < OCR_MIN_CHARS
+
+
+def page_text(page) -> str:
+    """OCR text of the images embedded in a ``pypdf`` page."""
+    if not OCR_ENABLED or _missing:
+        return ""
+    try:
+        images = list(page.images)
+    except Exception as exc:  # unsupported image filter
+        logger.warning("Could not read page images: %s", exc)
+        return ""
+    return "\n".join(text for text in (image_text(image.data) for image in images) if text)
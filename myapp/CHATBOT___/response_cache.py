@@ -0,0 +1,105 @@
+"""Bounded LRU + TTL cache for companion replies.
+
+Students frequently ask the same question with the same profile and state.
+Replies are keyed on the normalized question, profile, state and digests of
+the flattened history and of any retrieved document context, so a repeat is
+answered without a model round trip.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Thread-safe LRU cache bounded by entry count, total bytes and age."""
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 8 << 20, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries: OrderedDict[str, tuple[float, int, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, size, value = entry
+            if expires < time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _drop(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+def normalize_input(text: str) -> str:
+    text = re.sub(r"\s+", " ", (text or "").strip().lower())
+    return text.rstrip("?!. ")
+
+
+def adaptive_cache_key(
+    profile: str,
+    state: str,
+    user_input: str,
+    history: str | None = None,
+    context: str | None = None,
+) -> str:
+    history_digest = hashlib.sha256((history or "").encode("utf-8")).hexdigest()
+    context_digest = hashlib.sha256((context or "").encode("utf-8")).hexdigest()
+    raw = "\x1f".join(
+        [normalize_input(user_input), profile or "", state or "", history_digest, context_digest]
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def is_cacheable_reply(reply: str) -> bool:
+    """Errors and rate-limit replies must never be served from the cache."""
+    return bool(reply) and not reply.startswith("Model unavailable") and "429" not in reply
+
+
+adaptive_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_ENTRIES", "2048")),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_BYTES", str(8 << 20))),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+)
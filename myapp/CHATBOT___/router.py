@@ -0,0 +1,177 @@
+"""Latency- and health-aware routing between the primary and fallback models.
+
+The router keeps a rolling window of latencies and outcomes per model.  A
+model whose recent calls keep failing has its circuit opened: it is skipped
+for a cool-down period, after which a single probe call decides whether it is
+closed again.  When the primary is healthy but slow, the gateway hedges: if
+the primary has not answered by its recent p95 latency a second request goes
+to the fallback and whichever answers first wins.  Hedges are limited to a
+small fraction of traffic so tail latency drops without multiplying quota use.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+WINDOW_SECONDS = 60.0
+WINDOW_SAMPLES = 200
+MIN_SAMPLES = 5
+ERROR_RATE_TO_OPEN = 0.5
+CONSECUTIVE_FAILURES_TO_OPEN = 5
+OPEN_SECONDS = float(os.getenv("LLM_CIRCUIT_OPEN_SECONDS", "30"))
+# Fraction of calls that may be hedged, and the smallest delay worth hedging at.
+HEDGE_RATIO = float(os.getenv("LLM_HEDGE_RATIO", "0.1"))
+MIN_HEDGE_DELAY = 0.3
+
+
+class ModelHealth:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self):
+        # (time, latency, ok); ok is None for a call cancelled before it finished.
+        self.samples: deque[tuple[float, float | None, bool | None]] = deque(
+            maxlen=WINDOW_SAMPLES
+        )
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.probe_started: float | None = None
+
+    def _trim(self, now: float) -> None:
+        while self.samples and now - self.samples[0][0] > WINDOW_SECONDS:
+            self.samples.popleft()
+
+    def error_rate(self, now: float) -> float:
+        self._trim(now)
+        outcomes = [ok for _, _, ok in self.samples if ok is not None]
+        if not outcomes:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def p95(self, now: float) -> float | None:
+        self._trim(now)
+        latencies = sorted(
+            lat for _, lat, ok in self.samples if ok is not False and lat is not None
+        )
+        if len(latencies) < MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+
+
+class ModelRouter:
+    def __init__(self):
+        self._health: dict[str, ModelHealth] = {}
+        self._hedge_budget = 1.0
+
+    def health(self, model: str) -> ModelHealth:
+        return self._health.setdefault(model, ModelHealth())
+
+    def allow(self, model: str) -> bool:
+        """Whether a call to ``model`` may be made now (claims the probe when half-open)."""
+        h = self.health(model)
+        if h.state == ModelHealth.CLOSED:
+            return True
+        now = time.monotonic()
+        if h.state == ModelHealth.OPEN and now - h.opened_at >= OPEN_SECONDS:
+            h.state = ModelHealth.HALF_OPEN
+        # A probe that never reported back (shed or cancelled) expires.
+        if h.state == ModelHealth.HALF_OPEN and (
+            h.probe_started is None or now - h.probe_started >= OPEN_SECONDS
+        ):
+            h.probe_started = now
+            return True
+        return False
+
+    def record(self, model: str, latency: float | None, ok: bool) -> None:
+        """Records one call; ``latency`` may be None when it is not comparable (streams)."""
+        now = time.monotonic()
+        h = self.health(model)
+        h.samples.append((now, latency, ok))
+        h.consecutive_failures = 0 if ok else h.consecutive_failures + 1
+        if h.state == ModelHealth.HALF_OPEN:
+            h.probe_started = None
+            if ok:
+                h.state = ModelHealth.CLOSED
+                h.samples.clear()
+            else:
+                h.state, h.opened_at = ModelHealth.OPEN, now
+        elif h.state == ModelHealth.CLOSED and not ok:
+            failing = h.consecutive_failures >= CONSECUTIVE_FAILURES_TO_OPEN or (
+                len(h.samples) >= MIN_SAMPLES and h.error_rate(now) >= ERROR_RATE_TO_OPEN
+            )
+            if failing:
+                h.state, h.opened_at = ModelHealth.OPEN, now
+
+    def record_cancelled(self, model: str, elapsed: float) -> None:
+        """Records a call cancelled after ``elapsed`` seconds, e.g. because its hedge won.
+
+        ``elapsed`` is a lower bound on its latency and must still count
+        towards p95, or the slow calls that trigger hedging would never be
+        seen; the outcome is unknown, so the circuit state is left alone.
+        """
+        h = self.health(model)
+        h.samples.append((time.monotonic(), elapsed, None))
+        if h.state == ModelHealth.HALF_OPEN:
+            h.probe_started = None
+
+    def hedge_delay(self, model: str, backup: str) -> float | None:
+        """Delay after which a call to ``model`` should be hedged to ``backup``, or None.
+
+        Every call earns ``HEDGE_RATIO`` of a hedge; a hedge spends a whole one.
+        """
+        self._hedge_budget = min(self._hedge_budget + HEDGE_RATIO, 10.0)
+        if model == backup or self._hedge_budget < 1.0:
+            return None
+        if self.health(backup).state != ModelHealth.CLOSED:
+            return None
+        p95 = self.health(model).p95(time.monotonic())
+        if p95 is None:
+            return None
+        return max(p95, MIN_HEDGE_DELAY)
+
+    def spend_hedge(self) -> None:
+        self._hedge_budget -= 1.0
+
+    def snapshot(self) -> dict[str, dict]:
+        now = time.monotonic()
+        return {
+            model: {"state": h.state, "error_rate": h.error_rate(now), "p95": h.p95(now)}
+            for model, h in self._health.items()
+        }
+
+
+async def hedged(
+    primary: Callable[[], Awaitable[str]],
+    backup: Callable[[], Awaitable[str]],
+    delay: float,
+    on_hedge: Callable[[], None] = lambda: None,
+) -> str:
+    """Runs ``primary``; if it has not finished after ``delay`` also runs ``backup``.
+
+    Returns the first non-empty result and cancels the other call.  Otherwise
+    the primary's outcome (its exception or empty reply) is returned.
+    """
+    first = asyncio.ensure_future(primary())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            on_hedge()
+            tasks.append(asyncio.ensure_future(backup()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result():
+                    return task.result()
+        return first.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+router = ModelRouter()
@@ -0,0 +1,220 @@
+"""Priority- and fairness-aware admission for outbound model calls.
+
+Every call the gateway makes goes through one ``Scheduler`` which owns the
+process's model-call slots.  Waiting calls are served strictly by priority
+class (interactive chat, then snapshots, then bulk summaries) and, within a
+class, by weighted fair queueing on ``userId`` so one user's stack of uploads
+cannot crowd out everyone else in the same class.  Each user also has a token
+bucket bounding their sustained request rate.
+
+When a class's queue is full, or a call would wait longer than its class
+allows, the scheduler raises ``Overloaded`` straight away so the API can
+answer 503 with ``Retry-After`` instead of piling up blocked requests.
+
+The priority and user of the current request are carried in context
+variables (see ``use``), so the layers between the endpoint and the gateway
+do not need extra parameters.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+import deadline
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    SNAPSHOT = 1
+    BULK = 2
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed instead of queued."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "llm_priority", default=Priority.BULK
+)
+_user: contextvars.ContextVar[str | None] = contextvars.ContextVar("llm_user", default=None)
+
+
+def use(priority: Priority, user_id: str | None = None) -> None:
+    """Tags model calls made from the current context (request) with a class and user."""
+    _priority.set(priority)
+    _user.set(user_id)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        """Takes one token, possibly on credit, and returns how long to wait for it."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self) -> None:
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class Scheduler:
+    def __init__(
+        self,
+        capacity: int,
+        queue_limits: dict[Priority, int],
+        max_wait: dict[Priority, float],
+        user_rate: float = 1.0,
+        user_burst: float = 10.0,
+        weights: dict[str, float] | None = None,
+    ):
+        self.capacity = capacity
+        self.queue_limits = queue_limits
+        self.max_wait = max_wait
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.weights = weights or {}
+        self.active = 0
+        self.shed = 0
+        self._waiting = {p: 0 for p in Priority}
+        self._queues: dict[Priority, list] = {p: [] for p in Priority}
+        self._vtime = {p: 0.0 for p in Priority}
+        self._last_finish: dict[tuple[Priority, str | None], float] = {}
+        self._buckets: dict[str, TokenBucket] = {}
+        self._seq = itertools.count()
+
+    def depths(self) -> dict[str, int]:
+        return {p.name.lower(): n for p, n in self._waiting.items()}
+
+    def _shed(self, message: str, retry_after: float) -> Overloaded:
+        self.shed += 1
+        return Overloaded(message, retry_after)
+
+    def _bucket(self, user_id: str) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) > 10_000:
+                self._prune_buckets()
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def _prune_buckets(self) -> None:
+        now = time.monotonic()
+        idle = [
+            user_id
+            for user_id, b in self._buckets.items()
+            if b.tokens + (now - b.updated) * b.rate >= b.burst
+        ]
+        for user_id in idle:
+            del self._buckets[user_id]
+
+    async def acquire(self, priority: Priority | None = None, user_id: str | None = None) -> None:
+        priority = _priority.get() if priority is None else priority
+        user_id = _user.get() if user_id is None else user_id
+        max_wait = self.max_wait[priority]
+        # Never queue past the request's own deadline.
+        left = deadline.remaining()
+        queue_deadline = time.monotonic() + (max_wait if left is None else min(max_wait, left))
+
+        if user_id is not None:
+            bucket = self._bucket(user_id)
+            delay = bucket.reserve(time.monotonic())
+            if delay > max_wait:
+                bucket.refund()
+                raise self._shed(f"Rate limit exceeded for user {user_id}", delay)
+            if delay:
+                try:
+                    await deadline.sleep(delay)
+                except deadline.DeadlineExceeded:
+                    bucket.refund()
+                    raise
+
+        if self.active < self.capacity and not any(self._waiting.values()):
+            self.active += 1
+            return
+        if self._waiting[priority] >= self.queue_limits[priority]:
+            raise self._shed(f"{priority.name.lower()} queue is full", max_wait)
+
+        weight = self.weights.get(user_id, 1.0) if user_id is not None else 1.0
+        key = (priority, user_id)
+        start = max(self._vtime[priority], self._last_finish.get(key, 0.0))
+        finish = start + 1.0 / weight
+        self._last_finish[key] = finish
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queues[priority], (finish, next(self._seq), future))
+        self._waiting[priority] += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, max(queue_deadline - time.monotonic(), 0.0))
+        except asyncio.TimeoutError:
+            self._waiting[priority] -= 1
+            deadline.check()
+            raise self._shed(f"Timed out waiting in the {priority.name.lower()} queue", max_wait)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we were cancelled; hand it on.
+                self.release()
+            else:
+                self._waiting[priority] -= 1
+            raise
+        if len(self._last_finish) > 10_000:
+            floor = min(self._vtime.values())
+            self._last_finish = {k: v for k, v in self._last_finish.items() if v > floor}
+
+    def release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and self.active < self.capacity:
+                finish, _, future = heapq.heappop(queue)
+                if future.done():  # cancelled or timed out while waiting
+                    continue
+                self._vtime[priority] = finish
+                self._waiting[priority] -= 1
+                self.active += 1
+                future.set_result(None)
+            if self.active >= self.capacity:
+                return
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority | None = None, user_id: str | None = None):
+        await self.acquire(priority, user_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+scheduler = Scheduler(
+    capacity=int(os.getenv("LLM_CONCURRENCY", "16")),
+    queue_limits={
+        Priority.INTERACTIVE: int(os.getenv("LLM_QUEUE_INTERACTIVE", "200")),
+        Priority.SNAPSHOT: int(os.getenv("LLM_QUEUE_SNAPSHOT", "100")),
+        Priority.BULK: int(os.getenv("LLM_QUEUE_BULK", "50")),
+    },
+    max_wait={
+        Priority.INTERACTIVE: 10.0,
+        Priority.SNAPSHOT: 20.0,
+        Priority.BULK: 60.0,
+    },
+    user_rate=float(os.getenv("LLM_USER_RATE", "1.0")),
+    user_burst=float(os.getenv("LLM_USER_BURST", "10")),
+)
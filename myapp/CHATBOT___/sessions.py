@@ -0,0 +1,311 @@
+"""Server-side chat sessions, so clients send only the new message.
+
+Each session keeps its most recent turns in memory, bounded by both turn
+count and total characters; turns trimmed from the front are remembered only
+as a count and a chain digest, which is what the rolling summary in
+``conversation`` needs to stay valid.  Sessions idle for longer than
+``idle_seconds`` are evicted.
+
+With ``SESSION_DIR`` set, every turn is also appended to a per-session JSONL
+file by a background writer thread (the request path never waits on disk),
+so an evicted session is reloaded from its file on next use.  Several worker
+processes may serve the same session: ``get`` checks the file and reads the
+turns other processes appended since it last looked (or reloads it when it
+was compacted).  A file that grows past ``compact_bytes`` is rewritten with
+only the turns still kept, under an exclusive ``flock``, and files of
+sessions idle for ``SESSION_FILE_MAX_AGE`` are deleted by a
+``cache_sweep.CacheSweeper`` (which also caps the directory's total size).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from cache_sweep import CacheSweeper
+from conversation import chain_digest
+from metrics import store_seconds
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single worker process is assumed
+    fcntl = None
+
+logger = logging.getLogger("sessions")
+
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "200"))
+SESSION_MAX_CHARS = int(os.getenv("SESSION_MAX_CHARS", "200000"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+SESSION_FILE_MAX_AGE = float(os.getenv("SESSION_FILE_MAX_AGE", str(30 * 86400)))
+SESSION_DIR_MAX_BYTES = int(os.getenv("SESSION_DIR_MAX_BYTES", str(1 << 30)))
+
+# Tags the lines this process writes, so reading a session file back skips
+# the turns it already holds in memory.
+_WRITER = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class SessionOwnerMismatch(Exception):
+    """The session belongs to a different user."""
+
+
+@dataclass
+class Session:
+    id: str
+    user_id: str | None = None
+    turns: list[dict] = field(default_factory=list)
+    # Turns trimmed from the front: how many, and their chain digest.
+    offset: int = 0
+    seed: str = ""
+    chars: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    # How far the session file has been read, and which file it was.
+    read_pos: int = 0
+    inode: int | None = None
+
+
+class SessionStore:
+    """Bounded in-memory sessions with an optional append-only file per session."""
+
+    def __init__(
+        self,
+        root: Path | None = None,
+        max_turns: int = SESSION_MAX_TURNS,
+        max_chars: int = SESSION_MAX_CHARS,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+        max_sessions: int = MAX_SESSIONS,
+        compact_bytes: int | None = None,
+    ):
+        self.root = Path(root) if root else None
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        # Kept turns take at most about max_chars bytes plus per-line overhead.
+        self.compact_bytes = compact_bytes or 4 * max_chars + 200 * max_turns
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: threading.Thread | None = None
+        self._sweeper = (
+            CacheSweeper("sessions", self.root, SESSION_DIR_MAX_BYTES, SESSION_FILE_MAX_AGE)
+            if self.root is not None
+            else None
+        )
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _path(self, session_id: str) -> Path:
+        digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return self.root / digest[:2] / f"{digest}.jsonl"
+
+    def get(self, session_id: str, user_id: str | None = None) -> Session:
+        """The session, loading or creating it; checks it belongs to ``user_id``.
+
+        A session is owned by the first user id it was used with, and
+        ``user-<id>`` sessions by that user from the start.  May read the
+        session file, so call it from a worker thread.
+        """
+        if session_id.startswith("user-") and session_id != f"user-{user_id}":
+            raise SessionOwnerMismatch(session_id)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+        if session is not None and self.root is not None:
+            session = self._refresh(session)
+        if session is None:
+            session = self._load(session_id)
+            with self._lock:
+                # Another request may have loaded it meanwhile.
+                session = self._sessions.setdefault(session_id, session)
+                self._sessions.move_to_end(session_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted += 1
+        if session.user_id is None:
+            session.user_id = user_id
+        elif user_id != session.user_id:
+            raise SessionOwnerMismatch(session_id)
+        session.last_used = now
+        return session
+
+    def append(self, session: Session, role: str, content: str) -> None:
+        """Adds a turn, trimming the oldest ones past the limits."""
+        turn = {"role": role, "content": content}
+        with self._lock:
+            self._add(session, turn)
+            session.last_used = time.monotonic()
+        if self.root is not None:
+            self._ensure_writer()
+            self._queue.put((session.id, session.user_id, turn))
+
+    def _add(self, session: Session, turn: dict) -> None:
+        session.turns.append(turn)
+        session.chars += len(turn["content"])
+        while len(session.turns) > 1 and (
+            len(session.turns) > self.max_turns or session.chars > self.max_chars
+        ):
+            dropped = session.turns.pop(0)
+            session.chars -= len(dropped["content"])
+            session.seed = chain_digest([dropped], session.seed)
+            session.offset += 1
+
+    def _evict_idle(self, now: float) -> None:
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.idle_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    # ---------------------------------------------------------
+    # SESSION FILES
+    # ---------------------------------------------------------
+    def _read(self, session: Session, f, skip_own: bool) -> None:
+        """Applies the complete lines of ``f`` from ``session.read_pos`` on."""
+        f.seek(session.read_pos)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # still being written; read it next time
+            session.read_pos += len(line)
+            try:
+                record = json.loads(line)
+                if record.get("compacted"):
+                    session.offset, session.seed = int(record["offset"]), record["seed"]
+                    session.user_id = session.user_id or record.get("user")
+                    continue
+                turn = {"role": record["role"], "content": record["content"]}
+            except (ValueError, KeyError, TypeError):
+                continue  # torn write
+            if skip_own and record.get("w") == _WRITER:
+                continue  # already in memory
+            session.user_id = session.user_id or record.get("user")
+            self._add(session, turn)
+
+    def _load(self, session_id: str) -> Session:
+        session = Session(session_id)
+        if self.root is None:
+            return session
+        with store_seconds.time(store="sessions", op="load"):
+            try:
+                with open(self._path(session_id), "rb") as f:
+                    session.inode = os.fstat(f.fileno()).st_ino
+                    self._read(session, f, skip_own=False)
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                logger.warning("Could not load session %s: %s", session_id, exc)
+        return session
+
+    def _refresh(self, session: Session) -> Session:
+        """Picks up turns other processes wrote since ``session`` was last read."""
+        try:
+            stat = self._path(session.id).stat()
+        except FileNotFoundError:
+            return session  # not written yet, or expired; memory is all there is
+        except OSError as exc:
+            logger.warning("Could not check session %s: %s", session.id, exc)
+            return session
+        if stat.st_ino == session.inode and stat.st_size == session.read_pos:
+            return session
+        if session.inode is not None and stat.st_ino != session.inode:
+            # Compacted by some process: reload from scratch.
+            fresh = self._load(session.id)
+            fresh.user_id = fresh.user_id or session.user_id
+            with self._lock:
+                self._sessions[session.id] = fresh
+            return fresh
+        with store_seconds.time(store="sessions", op="refresh"):
+            try:
+                with open(self._path(session.id), "rb") as f:
+                    with self._lock:
+                        session.inode = os.fstat(f.fileno()).st_ino
+                        self._read(session, f, skip_own=True)
+            except OSError as exc:
+                logger.warning("Could not refresh session %s: %s", session.id, exc)
+        return session
+
+    def _open_locked(self, path: Path, exclusive: bool):
+        """``path`` opened for appending and flocked, retried if it was compacted meanwhile."""
+        while True:
+            f = open(path, "ab")
+            if fcntl is None:
+                return f
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _compact(self, session_id: str, path: Path) -> None:
+        """Rewrites the session file with only the turns a reload would keep."""
+        with store_seconds.time(store="sessions", op="compact"):
+            with self._open_locked(path, exclusive=True):
+                session = Session(session_id)
+                with open(path, "rb") as f:
+                    self._read(session, f, skip_own=False)
+                header = {
+                    "compacted": True,
+                    "user": session.user_id,
+                    "offset": session.offset,
+                    "seed": session.seed,
+                }
+                lines = [json.dumps(header)] + [
+                    json.dumps({"user": session.user_id, **turn}) for turn in session.turns
+                ]
+                tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+                os.replace(tmp, path)
+
+    def flush(self) -> None:
+        """Blocks until every queued turn has been written."""
+        if self._writer is not None:
+            self._queue.join()
+
+    # ---------------------------------------------------------
+    # WRITER THREAD
+    # ---------------------------------------------------------
+    def _ensure_writer(self) -> None:
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self._run, name="session-writer", daemon=True
+                    )
+                    self._writer.start()
+
+    def _run(self) -> None:
+        while True:
+            session_id, user_id, turn = self._queue.get()
+            try:
+                path = self._path(session_id)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                line = json.dumps({"user": user_id, "ts": time.time(), "w": _WRITER, **turn})
+                with store_seconds.time(store="sessions", op="append"):
+                    with self._open_locked(path, exclusive=False) as f:
+                        f.write((line + "\n").encode("utf-8"))
+                        size = f.tell()
+                if size > self.compact_bytes:
+                    self._compact(session_id, path)
+                self._sweeper.written()
+            except OSError as exc:
+                logger.warning("Dropping turn for session %s: %s", session_id, exc)
+            finally:
+                self._queue.task_done()
+
+
+session_store = SessionStore(os.getenv("SESSION_DIR") or None)
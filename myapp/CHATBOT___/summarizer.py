@@ -0,0 +1,148 @@
+"""Map-reduce summarization for documents larger than one prompt.
+
+Text is split on page and paragraph boundaries into chunks that fit a token
+budget.  Chunks are summarized concurrently by a bounded number of workers as
+soon as they are formed, so extraction of later pages (see ``extraction``)
+overlaps with the model work on earlier ones.  The partial summaries are then
+combined level by level until a single summary remains.
+"""
+
+import asyncio
+import os
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from core import SUMMARY_CFG
+from llm_gateway import call_model_async, summarize_text_async
+
+CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "4000"))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "4"))
+# Upper bound on how many partial summaries are combined in one reduce prompt.
+REDUCE_FAN_IN = 8
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English prose)."""
+    return len(text) // 4 + 1
+
+
+def _split_oversized(text: str, budget: int) -> Iterator[str]:
+    """Splits a single page that exceeds the budget on paragraphs, then lines, then characters."""
+    for sep in ("\n\n", "\n"):
+        parts = text.split(sep)
+        if len(parts) > 1:
+            chunker = Chunker(budget, sep)
+            for part in parts:
+                yield from chunker.feed(part)
+            yield from chunker.flush()
+            return
+    step = budget * 4
+    for start in range(0, len(text), step):
+        yield text[start:start + step]
+
+
+class Chunker:
+    """Packs consecutive pages into chunks of at most ``budget`` estimated tokens."""
+
+    def __init__(self, budget: int = CHUNK_TOKENS, sep: str = "\n"):
+        self.budget = budget
+        self.sep = sep
+        self._parts: list[str] = []
+        self._tokens = 0
+
+    def feed(self, page: str) -> Iterator[str]:
+        if not page.strip():
+            return
+        tokens = estimate_tokens(page)
+        if tokens > self.budget:
+            yield from self.flush()
+            yield from _split_oversized(page, self.budget)
+            return
+        if self._tokens + tokens > self.budget:
+            yield from self.flush()
+        self._parts.append(page)
+        self._tokens += tokens
+
+    def flush(self) -> Iterator[str]:
+        if self._parts:
+            yield self.sep.join(self._parts)
+        self._parts = []
+        self._tokens = 0
+
+
+def _reduce_prompt(partials: list[str], context: str) -> str:
+    joined = "\n\n".join(f"Part {i}:\n{p}" for i, p in enumerate(partials, 1))
+    return (
+        "Combine these partial summaries of one document into a single concise "
+        f"summary. {context}:\n\n{joined}"
+    )
+
+
+async def _reduce(partials: list[str], context: str, slots: asyncio.Semaphore) -> str:
+    async def combine(group: list[str]) -> str:
+        async with slots:
+            return await call_model_async(_reduce_prompt(group, context), cfg=SUMMARY_CFG)
+
+    while len(partials) > 1:
+        groups: list[list[str]] = []
+        tokens = 0
+        for partial in partials:
+            cost = estimate_tokens(partial)
+            if not groups or len(groups[-1]) >= REDUCE_FAN_IN or tokens + cost > CHUNK_TOKENS:
+                groups.append([])
+                tokens = 0
+            groups[-1].append(partial)
+            tokens += cost
+        partials = await asyncio.gather(*(combine(g) if len(g) > 1 else _done(g[0]) for g in groups))
+        failed = next((p for p in partials if p.startswith("Model unavailable")), None)
+        if failed:
+            return failed
+    return partials[0]
+
+
+async def _done(value: str) -> str:
+    return value
+
+
+async def summarize_pages(pages: AsyncIterable[str], context: str = "") -> str:
+    """Summarizes a stream of pages, starting on each chunk as soon as it is complete.
+
+    Like ``summarize_text`` this returns a "Model unavailable: ..." string
+    rather than raising when the model cannot be reached.
+    """
+    slots = asyncio.Semaphore(SUMMARY_WORKERS)
+    chunker = Chunker()
+    tasks: list[asyncio.Task] = []
+
+    async def summarize_chunk(chunk: str) -> str:
+        async with slots:
+            return await summarize_text_async(chunk, context)
+
+    try:
+        async for page in pages:
+            for chunk in chunker.feed(page):
+                tasks.append(asyncio.create_task(summarize_chunk(chunk)))
+        for chunk in chunker.flush():
+            tasks.append(asyncio.create_task(summarize_chunk(chunk)))
+        partials = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    if not partials:
+        return await summarize_text_async("", context)
+    failed = next((p for p in partials if p.startswith("Model unavailable")), None)
+    if failed:
+        return failed
+    return await _reduce(list(partials), context, slots)
+
+
+async def _aiter(items: Iterable[str]) -> AsyncIterator[str]:
+    for item in items:
+        yield item
+
+
+async def summarize_long_text(text: str, context: str = "") -> str:
+    """Summarizes already extracted text of any length."""
+    return await summarize_pages(_aiter(text.split("\n\n")), context)
+
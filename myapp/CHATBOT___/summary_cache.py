@@ -0,0 +1,141 @@
+"""Content-addressed summary cache with in-flight request coalescing.
+
+When a teacher shares a link or handout the whole class uploads the same
+content within seconds.  Summaries are stored under a digest of the extracted
+text or uploaded bytes (and of the URL for ``/api/process-url``) in a small on-disk store that
+survives restarts, and concurrent identical requests await a single shared
+computation instead of each calling the model.  The store is kept within
+``SUMMARY_CACHE_MAX_BYTES`` and ``SUMMARY_CACHE_MAX_AGE`` by a
+``cache_sweep.CacheSweeper``.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from cache_sweep import CacheSweeper
+
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", str(256 << 20)))
+SUMMARY_CACHE_MAX_AGE = float(os.getenv("SUMMARY_CACHE_MAX_AGE", str(30 * 86400)))
+
+
+def text_key(text: str) -> str:
+    return "text-" + hashlib.sha256(text.encode("utf-8", "ignore")).hexdigest()
+
+
+def file_key(sha256_hex: str) -> str:
+    """Key for an uploaded file given the sha256 of its raw bytes."""
+    return "file-" + sha256_hex
+
+
+def url_key(url: str) -> str:
+    return "url-" + hashlib.sha256(url.strip().encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """Summaries kept in a bounded in-memory LRU backed by one JSON file per key."""
+
+    def __init__(
+        self,
+        root: Path,
+        max_memory: int = 512,
+        max_bytes: int = SUMMARY_CACHE_MAX_BYTES,
+        max_age: float = SUMMARY_CACHE_MAX_AGE,
+    ):
+        self.root = Path(root)
+        self.max_memory = max_memory
+        self.sweeper = CacheSweeper("summary_cache", self.root, max_bytes, max_age)
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key.rsplit("-", 1)[-1][:2] / f"{key}.json"
+
+    def get(self, key: str, max_age: float | None = None) -> str | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None:
+            try:
+                data = json.loads(self._path(key).read_text())
+                entry = (float(data["created"]), data["summary"])
+            except (OSError, ValueError, KeyError):
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+        created, summary = entry
+        if max_age is not None and time.time() - created > max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return summary
+
+    def put(self, key: str, summary: str) -> None:
+        entry = (time.time(), summary)
+        self._remember(key, entry)
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"created": entry[0], "summary": summary}))
+        os.replace(tmp, path)
+        self.sweeper.written()
+
+    def _remember(self, key: str, entry: tuple[float, str]) -> None:
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory:
+                self._memory.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[str]],
+        max_age: float | None = None,
+    ) -> str:
+        """Returns the cached summary or runs ``compute`` once for all concurrent callers.
+
+        Exceptions raised by ``compute`` propagate to every waiter and nothing
+        is stored, so failures are retried by the next request.
+        """
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        cached = await asyncio.to_thread(self.get, key, max_age)
+        if cached is not None:
+            return cached
+
+        # Another request may have started while we were reading the disk.
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        # The computation runs as its own task so that a leader whose client
+        # disconnects does not cancel the work the other waiters share.
+        task = asyncio.ensure_future(self._compute_and_store(key, compute))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _compute_and_store(
+        self, key: str, compute: Callable[[], Awaitable[str]]
+    ) -> str:
+        summary = await compute()
+        await asyncio.to_thread(self.put, key, summary)
+        return summary
+
+
+URL_SUMMARY_TTL = float(os.getenv("URL_SUMMARY_TTL", "3600"))
+
+summary_cache = SummaryCache(Path(os.getenv("SUMMARY_CACHE_DIR", "summary_cache")))
@@ -0,0 +1,15 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "bench"))
+
+import import_budget  # noqa: E402
+
+
+@pytest.mark.parametrize("module", sorted(import_budget.BUDGETS_MS))
+def test_import_budget(module, tmp_path):
+    row = import_budget.check(module, str(tmp_path), runs=3)
+    assert not row["heavy_modules"], f"{module} loads {row['heavy_modules']} on import"
+    assert row["ok"], f"{module} imports in {row['median_ms']} ms, budget {row['budget_ms']} ms"
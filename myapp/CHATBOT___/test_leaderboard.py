@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from leaderboard import Leaderboard, RankIndex
+
+
+def test_rank_and_slice_match_sorted():
+    rng = random.Random(7)
+    index = RankIndex()
+    keys: set = set()
+    for _ in range(3000):
+        key = (rng.randrange(-500, 0), f"u{rng.randrange(400)}")
+        if key in keys and rng.random() < 0.5:
+            index.remove(key)
+            keys.discard(key)
+        elif key not in keys:
+            index.insert(key)
+            keys.add(key)
+    expected = sorted(keys)
+    assert len(index) == len(expected)
+    for pos, key in enumerate(expected):
+        assert index.rank(key) == pos
+    for start, stop in [(0, 10), (5, 6), (len(expected) - 3, len(expected) + 5), (-4, 3), (9, 9)]:
+        assert index.slice(start, stop) == expected[max(start, 0):stop]
+    assert index.slice(0, len(expected)) == expected
+
+
+def test_remove_missing_key():
+    index = RankIndex()
+    index.insert((1, "a"))
+    with pytest.raises(KeyError):
+        index.remove((2, "a"))
+    with pytest.raises(KeyError):
+        index.rank((0, "a"))
+
+
+def test_leaderboard_order_and_standing():
+    board = Leaderboard([("carol", 50), ("alice", 100), ("bob", 100), ("dave", 10)])
+    assert [e["userId"] for e in board.top(10)] == ["alice", "bob", "carol", "dave"]
+    standing = board.standing("carol", radius=1)
+    assert standing["rank"] == 3
+    assert [e["userId"] for e in standing["neighbors"]] == ["bob", "carol", "dave"]
+    assert board.standing("nobody") is None
+
+
+def test_leaderboard_ignores_lower_totals():
+    board = Leaderboard([("alice", 10), ("bob", 20)])
+    board.update("alice", 30)
+    board.update("alice", 25)  # an older total reported late
+    assert board.top(1) == [{"rank": 1, "userId": "alice", "totalXP": 30}]
+    assert len(board) == 2
+
+
+def test_standing_near_the_edges():
+    board = Leaderboard([("a", 100), ("b", 50), ("c", 10)])
+    top = board.standing("a", radius=3)
+    assert [(e["rank"], e["userId"]) for e in top["neighbors"]] == [(1, "a"), (2, "b"), (3, "c")]
+    bottom = board.standing("c", radius=1)
+    assert [(e["rank"], e["userId"]) for e in bottom["neighbors"]] == [(2, "b"), (3, "c")]
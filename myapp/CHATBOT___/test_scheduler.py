@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from scheduler import Overloaded, Priority, Scheduler
+
+
+def make_scheduler(capacity=1, queue_limit=10, max_wait=5.0) -> Scheduler:
+    return Scheduler(
+        capacity=capacity,
+        queue_limits={p: queue_limit for p in Priority},
+        max_wait={p: max_wait for p in Priority},
+        user_rate=1000.0,
+        user_burst=1000.0,
+    )
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_serves_higher_priority_first():
+    async def main():
+        sched = make_scheduler()
+        order = []
+
+        async def call(name, priority, user_id=None):
+            async with sched.slot(priority, user_id):
+                order.append(name)
+
+        await sched.acquire(Priority.BULK)
+        tasks = []
+        for name, priority in [
+            ("bulk", Priority.BULK),
+            ("snapshot", Priority.SNAPSHOT),
+            ("chat", Priority.INTERACTIVE),
+        ]:
+            tasks.append(asyncio.ensure_future(call(name, priority)))
+            await settle()
+        assert sched.depths() == {"interactive": 1, "snapshot": 1, "bulk": 1}
+        sched.release()
+        await asyncio.gather(*tasks)
+        assert order == ["chat", "snapshot", "bulk"]
+        assert sched.active == 0
+
+    asyncio.run(main())
+
+
+def test_fair_between_users_in_a_class():
+    async def main():
+        sched = make_scheduler()
+        order = []
+
+        async def call(user_id):
+            async with sched.slot(Priority.BULK, user_id):
+                order.append(user_id)
+
+        await sched.acquire(Priority.BULK)
+        tasks = [asyncio.ensure_future(call(u)) for u in ["a", "a", "a", "b"]]
+        await settle()
+        sched.release()
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "a", "a"]
+
+    asyncio.run(main())
+
+
+def test_sheds_when_queue_is_full():
+    async def main():
+        sched = make_scheduler(queue_limit=1)
+        await sched.acquire(Priority.BULK)
+        waiter = asyncio.ensure_future(sched.acquire(Priority.BULK))
+        await settle()
+        with pytest.raises(Overloaded):
+            await sched.acquire(Priority.BULK)
+        assert sched.shed == 1
+        # Other classes have their own queues.
+        other = asyncio.ensure_future(sched.acquire(Priority.INTERACTIVE))
+        await settle()
+        assert sched.depths()["interactive"] == 1
+        sched.release()
+        await other
+        sched.release()
+        await waiter
+        sched.release()
+        assert sched.active == 0
+
+    asyncio.run(main())
+
+
+def test_sheds_after_max_wait():
+    async def main():
+        sched = make_scheduler(max_wait=0.05)
+        await sched.acquire(Priority.BULK)
+        with pytest.raises(Overloaded):
+            await sched.acquire(Priority.BULK)
+        assert sched.shed == 1
+        assert sched.depths()["bulk"] == 0
+        sched.release()
+        assert sched.active == 0
+        # The timed-out entry left in the heap is skipped.
+        await sched.acquire(Priority.BULK)
+        assert sched.active == 1
+
+    asyncio.run(main())
+
+
+def test_cancel_after_grant_hands_the_slot_on():
+    async def main():
+        sched = make_scheduler()
+        await sched.acquire(Priority.BULK)
+        first = asyncio.ensure_future(sched.acquire(Priority.BULK))
+        await settle()
+        second_done = asyncio.Event()
+
+        async def second():
+            async with sched.slot(Priority.BULK):
+                second_done.set()
+
+        second_task = asyncio.ensure_future(second())
+        await settle()
+        # Grant the slot to ``first`` and cancel it before it gets to run.
+        sched.release()
+        first.cancel()
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        else:
+            # The grant won the race: the waiter holds the slot and must release it.
+            sched.release()
+        await asyncio.wait_for(second_done.wait(), 1.0)
+        await second_task
+        assert sched.active == 0
+        assert sched.depths()["bulk"] == 0
+
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+"""Per-user topic memory in a WAL-mode SQLite database.
+
+``add`` only enqueues; a background writer thread drains the queue and
+writes each batch in a single transaction, so the request path never waits
+on disk.  Dedupe is an ``INSERT OR IGNORE`` against the ``(user_id, topic)``
+unique index, and WAL mode plus a busy timeout make the database safe to share
+between uvicorn worker processes.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+
+from db import connect
+from metrics import store_seconds
+
+logger = logging.getLogger("topic_store")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS topics (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    UNIQUE (user_id, topic)
+);
+CREATE INDEX IF NOT EXISTS topics_by_user ON topics (user_id, id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class TopicStore:
+    """Keeps the most recent ``max_topics`` distinct topics per user."""
+
+    def __init__(
+        self,
+        path: Path,
+        max_topics: int = 200,
+        flush_interval: float = 0.5,
+        batch_size: int = 256,
+    ):
+        self.path = Path(path)
+        self.max_topics = max_topics
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue()
+        self._local = threading.local()
+        self._writer: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        with closing(connect(self.path)) as conn:
+            conn.executescript(SCHEMA)
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    def _ensure_writer(self) -> None:
+        if self._writer is None:
+            with self._start_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self._run, name="topic-store-writer", daemon=True
+                    )
+                    self._writer.start()
+
+    def add(self, user_id: str, topic: str) -> None:
+        """Queues a topic for ``user_id``; returns immediately."""
+        self._ensure_writer()
+        self._queue.put((user_id, topic))
+
+    def topics(self, user_id: str) -> list[str]:
+        """Topics for ``user_id``, oldest first (flushed writes only)."""
+        with store_seconds.time(store="topics", op="read"):
+            rows = self._reader().execute(
+                "SELECT topic FROM topics WHERE user_id = ? ORDER BY id", (user_id,)
+            )
+            return [row[0] for row in rows]
+
+    def flush(self) -> None:
+        """Blocks until every queued topic has been written."""
+        if self._writer is not None:
+            self._queue.join()
+
+    # ---------------------------------------------------------
+    # WRITER THREAD
+    # ---------------------------------------------------------
+    def _run(self) -> None:
+        conn = connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                pass
+            try:
+                with store_seconds.time(store="topics", op="write_batch"):
+                    self._write(conn, batch)
+            except sqlite3.Error as exc:
+                logger.warning("Dropping %s topics after write failure: %s", len(batch), exc)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, conn: sqlite3.Connection, batch: list[tuple[str, str]]) -> None:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO topics (user_id, topic) VALUES (?, ?)", batch
+            )
+            for user_id in {user_id for user_id, _ in batch}:
+                conn.execute(
+                    """
+                    DELETE FROM topics WHERE user_id = ? AND id <= (
+                        SELECT id FROM topics WHERE user_id = ?
+                        ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )
+                    """,
+                    (user_id, user_id, self.max_topics),
+                )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def migrate_json(self, json_path: Path, user_id: str = "") -> None:
+        """One-time import of the legacy ``{"topics": [...]}`` memory file."""
+        if not json_path.exists():
+            return
+        with closing(connect(self.path)) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            done = conn.execute(
+                "SELECT 1 FROM meta WHERE key = 'json_migrated'"
+            ).fetchone()
+            if done:
+                conn.execute("COMMIT")
+                return
+            try:
+                topics = json.loads(json_path.read_text()).get("topics", [])
+            except (OSError, ValueError, AttributeError):
+                topics = []
+            conn.executemany(
+                "INSERT OR IGNORE INTO topics (user_id, topic) VALUES (?, ?)",
+                [(user_id, str(t)) for t in topics[-self.max_topics:]],
+            )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(json_path),))
+            conn.execute("COMMIT")
+
+
+def open_store(path: Path, legacy_json: Path | None = None, **kwargs) -> TopicStore:
+    store = TopicStore(path, **kwargs)
+    if legacy_json is not None:
+        store.migrate_json(legacy_json)
+    atexit.register(store.flush)
+    return store
@@ -0,0 +1,102 @@
+"""Size-bounded, streaming ingestion of request bodies.
+
+Uploads are copied to uniquely named temp files in fixed-size chunks instead
+of being read into memory, and requests whose body is larger than the limit
+for their route are rejected as early as possible: up front when they declare
+a ``Content-Length``, otherwise as soon as the running byte count crosses it.
+"""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from fastapi import HTTPException, Request, UploadFile
+from starlette.responses import JSONResponse
+
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "temp_uploads"))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1 << 20)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 << 20)))
+MAX_SNAPSHOT_BYTES = int(os.getenv("MAX_SNAPSHOT_BYTES", str(10 << 20)))
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(100 << 20)))
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Payload exceeds {limit} bytes")
+
+
+class BodySizeLimitMiddleware:
+    """ASGI middleware enforcing a per-path-prefix cap on request body size."""
+
+    def __init__(self, app, limits: dict[str, int]):
+        self.app = app
+        # Longest prefix first so more specific routes win.
+        self.limits = sorted(limits.items(), key=lambda kv: -len(kv[0]))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = next(
+            (size for prefix, size in self.limits if scope["path"].startswith(prefix)), None
+        )
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope.get("headers") or []).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            response = JSONResponse({"detail": _too_large(limit).detail}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> tuple[Path, str]:
+    """Copies an upload to a unique temp file in chunks.
+
+    Returns the path (keeping only the client's file extension, never its
+    name) and the sha256 of the contents.  The caller owns the file.
+    """
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    suffix = Path(file.filename or "").suffix.lower()
+    if not suffix[1:].isalnum():
+        suffix = ""
+    fd, name = tempfile.mkstemp(suffix=suffix, dir=UPLOAD_DIR)
+    path = Path(name)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path, digest.hexdigest()
+
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """Reads a raw request body, failing with 413 once it exceeds ``max_bytes``."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise _too_large(max_bytes)
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise _too_large(max_bytes)
+    return bytes(body)
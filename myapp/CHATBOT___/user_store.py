@@ -0,0 +1,204 @@
+"""SQLite-backed user records for the avatar API.
+
+Each user is one row holding the JSON document ``avatar_api`` works with, so
+reading or updating a user costs the same however many users are registered.
+``update`` runs its read-modify-write inside a ``BEGIN IMMEDIATE``
+transaction, which serializes concurrent writers (across threads and worker
+processes) and closes the lost-update/double-spend window of the old
+load-everything/save-everything cycle.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Callable
+
+from db import connect
+from metrics import store_seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS user_xp_events (
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (user_id, key)
+);
+CREATE INDEX IF NOT EXISTS user_xp_events_by_created ON user_xp_events (created);
+"""
+
+# Earlier versions kept idempotency keys in ``xp_events`` keyed by the key
+# alone, so two users sending the same key collided.
+MIGRATE_XP_EVENTS = """
+INSERT OR IGNORE INTO user_xp_events (user_id, key, amount, created)
+    SELECT user_id, key, amount, created FROM xp_events;
+DROP TABLE xp_events;
+"""
+
+# How long idempotency keys are remembered.
+EVENT_KEY_RETENTION = 7 * 24 * 3600
+
+
+class Rejected(Exception):
+    """Raised from an ``update`` callback to abort the transaction with an API error."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class UserStore:
+    def __init__(self, path: Path, new_user: Callable[[str], dict]):
+        self.path = Path(path)
+        self.new_user = new_user
+        self._local = threading.local()
+        with closing(connect(self.path, timeout=10.0)) as conn:
+            conn.executescript(SCHEMA)
+            legacy = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'xp_events'"
+            ).fetchone()
+            if legacy:
+                conn.executescript(f"BEGIN IMMEDIATE;{MIGRATE_XP_EVENTS}COMMIT;")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path, timeout=10.0)
+        return conn
+
+    def get(self, user_id: str) -> dict | None:
+        with store_seconds.time(store="users", op="get"):
+            row = self._conn().execute(
+                "SELECT data FROM users WHERE id = ?", (user_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def totals(self) -> list[tuple[str, int]]:
+        """``(user_id, totalXP)`` for every user, used to seed the leaderboard."""
+        rows = self._conn().execute(
+            "SELECT id, COALESCE(json_extract(data, '$.totalXP'), 0) FROM users"
+        )
+        return [(user_id, int(total)) for user_id, total in rows]
+
+    def update(self, user_id: str, change: Callable[[dict], None]) -> dict:
+        """Atomically applies ``change`` to the user (created if missing) and returns it.
+
+        ``change`` mutates the user in place and may raise ``Rejected`` to
+        abort without writing anything.
+        """
+        with store_seconds.time(store="users", op="update"):
+            return self._update(user_id, change)
+
+    def _update(self, user_id: str, change: Callable[[dict], None]) -> dict:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+            user = json.loads(row[0]) if row else self.new_user(user_id)
+            change(user)
+            conn.execute(
+                "INSERT INTO users (id, data) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                (user_id, json.dumps(user)),
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return user
+
+    def apply_xp_events(
+        self,
+        events: list[tuple[str | None, str, int]],
+        apply: Callable[[dict, int], None],
+    ) -> tuple[dict[str, dict], int]:
+        """Applies ``(idempotency_key, user_id, amount)`` events in one transaction.
+
+        Events whose key was already recorded for the same user (in this or
+        an earlier batch) are skipped; keys are scoped per user.  The remaining amounts are summed per user and ``apply``
+        is called once per user, so each user row is written once per batch.
+        Returns the updated users and the number of duplicates skipped.
+        """
+        with store_seconds.time(store="users", op="apply_xp_events"):
+            return self._apply_xp_events(events, apply)
+
+    def _apply_xp_events(
+        self,
+        events: list[tuple[str | None, str, int]],
+        apply: Callable[[dict, int], None],
+    ) -> tuple[dict[str, dict], int]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM user_xp_events WHERE created < ?", (now - EVENT_KEY_RETENTION,)
+            )
+            totals: dict[str, int] = {}
+            duplicates = 0
+            for key, user_id, amount in events:
+                if key is not None:
+                    inserted = conn.execute(
+                        "INSERT OR IGNORE INTO user_xp_events (user_id, key, amount, created) "
+                        "VALUES (?, ?, ?, ?)",
+                        (user_id, key, amount, now),
+                    ).rowcount
+                    if not inserted:
+                        duplicates += 1
+                        continue
+                totals[user_id] = totals.get(user_id, 0) + amount
+
+            updated = {}
+            for user_id, amount in totals.items():
+                row = conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+                user = json.loads(row[0]) if row else self.new_user(user_id)
+                apply(user, amount)
+                conn.execute(
+                    "INSERT INTO users (id, data) VALUES (?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                    (user_id, json.dumps(user)),
+                )
+                updated[user_id] = user
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return updated, duplicates
+
+    def migrate_json(self, json_path: Path) -> int:
+        """One-time import of the legacy ``avatar_users.json``; returns users imported."""
+        if not json_path.exists():
+            return 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                conn.execute("COMMIT")
+                return 0
+            try:
+                users = json.loads(json_path.read_text())
+            except (OSError, ValueError):
+                users = {}
+            if not isinstance(users, dict):
+                users = {}
+            conn.executemany(
+                "INSERT OR IGNORE INTO users (id, data) VALUES (?, ?)",
+                [(user_id, json.dumps(user)) for user_id, user in users.items()],
+            )
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(json_path),)
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return len(users)